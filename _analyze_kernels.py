@@ -0,0 +1,30 @@
+"""
+Reward-aggregation kernels for SelfImprover.analyze.
+
+group_sums(idx, vals, ng) -> (per-group sum of vals, per-group count) for int
+codes 0..ng-1. With numba installed it is a compiled single pass over the arrays
+(cached to __pycache__ after the first call); without it, two np.bincount calls.
+"""
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def _group_sums_numpy(idx, vals, ng):
+    return np.bincount(idx, weights=vals, minlength=ng), np.bincount(idx, minlength=ng)
+
+
+if njit is not None:
+    @njit(cache=True)
+    def group_sums(idx, vals, ng):
+        s = np.zeros(ng)
+        c = np.zeros(ng, np.int64)
+        for k in range(idx.size):
+            s[idx[k]] += vals[k]
+            c[idx[k]] += 1
+        return s, c
+else:
+    group_sums = _group_sums_numpy
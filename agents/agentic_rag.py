@@ -8,92 +8,196 @@ WHAT IT DOES: Retrieve → Grade relevance → Reformulate if bad → Generate 
 WHY LEARN IT: THIS IS THE INTERVIEW STAR. Shows you understand agents, reflection, self-correction.
 KEY INSIGHT: Agents don't just retrieve — they evaluate, decide, and retry.
 """
-from agents.base import BaseRAGAgent
-from vectorstore import store_manager
-from llm import llm_call, llm_json
+from agents.base import BaseRAGAgent, format_context, preview, source_entry
+from vectorstore import get_store_manager
+from llm import llm_call_async, llm_call_stream, llm_json_async, llm_structured, parse_json
 from config import settings
+from contextlib import aclosing
+from pydantic import BaseModel
+import asyncio
+import json
+
+
+class AgenticResult(BaseModel):
+    """Final pass output: grading, answer and grounding check in one response."""
+    relevant_ids: list[int]
+    answer: str
+    grounded: bool
+    unsupported_claims: list[str]
+
 
 class AgenticRAGAgent(BaseRAGAgent):
     name = "agentic_rag"
     description = "Self-correcting RAG with relevance grading, query reformulation, and hallucination checks."
 
     COLLECTION = "naive_rag"  # reuses the same store, different retrieval logic
+    MIN_RELEVANT = 2  # enough relevant docs to stop retrying
 
     async def retrieve(self, query, top_k=5):
-        return store_manager.search(self.COLLECTION, query, k=top_k)
+        return await get_store_manager().asearch(self.COLLECTION, query, k=top_k)
+
+    async def grade_relevance(self, query: str, docs: list,
+                              min_relevant: int | None = None) -> tuple[list, list]:
+        """LLM grades all docs in one streamed call. Returns (relevant, irrelevant).
+        With min_relevant set, stops reading as soon as that many docs pass —
+        docs not graded by then count as irrelevant."""
+        if not docs:
+            return [], []
+        payload = "\n".join(f"[{i}] {preview(d, 600)}" for i, d in enumerate(docs))
+        system = (
+            "Grade whether each numbered document is relevant to the question. "
+            "Output one JSON object per line, in document order, and nothing else: "
+            "{\"id\": 0, \"relevant\": true/false, \"reason\": \"brief reason\"}"
+        )
+
+        grades, buf, n_relevant = {}, "", 0
+        async with aclosing(llm_call_stream(system, f"Question: {query}\n\nDocuments:\n{payload}")) as tokens:
+            async for tok in tokens:
+                buf += tok
+                *lines, buf = buf.split("\n")
+                for line in lines:
+                    grade = self._parse_grade(line)
+                    if grade is not None:
+                        grades[grade["id"]] = grade
+                        n_relevant += bool(grade.get("relevant", False))
+                if min_relevant is not None and n_relevant >= min_relevant:
+                    break
+            else:
+                grade = self._parse_grade(buf)
+                if grade is not None:
+                    grades[grade["id"]] = grade
 
-    async def grade_relevance(self, query: str, docs: list) -> tuple[list, list]:
-        """LLM grades each doc. Returns (relevant, irrelevant)."""
         relevant, irrelevant = [], []
-        for doc in docs:
-            result = llm_json(
-                "Grade if this document is relevant to the question. "
-                "Return: {\"relevant\": true/false, \"reason\": \"brief reason\"}",
-                f"Question: {query}\nDocument: {doc.page_content[:600]}"
-            )
-            if result.get("relevant", False):
-                doc.metadata["grade_reason"] = result.get("reason", "")
+        for i, doc in enumerate(docs):
+            grade = grades.get(i, {})
+            if grade.get("relevant", False):
+                doc.metadata["grade_reason"] = grade.get("reason", "")
                 relevant.append(doc)
             else:
                 irrelevant.append(doc)
         return relevant, irrelevant
 
-    async def reformulate(self, query: str, attempt: int) -> str:
-        return llm_call(
+    @staticmethod
+    def _parse_grade(line: str) -> dict | None:
+        try:
+            grade = parse_json(line.strip().rstrip(","))
+        except json.JSONDecodeError:
+            return None
+        if isinstance(grade, dict) and isinstance(grade.get("id"), int):
+            return grade
+        return None
+
+    async def reformulate(self, query: str, n: int) -> list[str]:
+        """Up to n diverse rewrites of the query, from a single call."""
+        if n <= 0:
+            return []
+        result = await llm_json_async(
             "Rewrite this search query to find better, more relevant results. "
-            "Try a different angle or phrasing. Return ONLY the new query.",
-            f"Original query (attempt {attempt}): {query}"
-        ).strip()
-
-    async def check_hallucination(self, answer: str, docs: list) -> dict:
-        ctx = "\n".join([d.page_content[:400] for d in docs])
-        return llm_json(
-            "Check if the answer is fully supported by the context. "
-            "Return: {\"grounded\": true/false, \"unsupported_claims\": [\"...\"]}",
-            f"Context:\n{ctx}\n\nAnswer: {answer}"
+            f"Produce {n} diverse rewrites, each trying a different angle or phrasing. "
+            "Return: {\"queries\": [\"rewrite 1\", ...]}",
+            f"Original query: {query}"
+        )
+        queries = [q.strip() for q in result.get("queries", []) if isinstance(q, str) and q.strip()]
+        return queries[:n]
+
+    async def _graded_retrievals(self, query: str, search_queries: list[str], top_k: int) -> list[tuple]:
+        """Retrieve for every search query (one batched embedding call), then grade
+        all result sets against the ORIGINAL query concurrently."""
+        if not search_queries:
+            return []
+        results = await get_store_manager().asearch_many(self.COLLECTION, search_queries, k=top_k)
+        grades = await asyncio.gather(*[
+            self.grade_relevance(query, docs, min_relevant=self.MIN_RELEVANT) for docs in results
+        ])
+        return [(q, docs, rel, irr) for q, docs, (rel, irr) in zip(search_queries, results, grades)]
+
+    async def answer_and_verify(self, query: str, docs: list) -> AgenticResult:
+        """One structured call that grades the docs, answers from the relevant ones,
+        and reports whether that answer is grounded — instead of three serial calls."""
+        numbered = "\n\n".join(f"[{i}] {d.page_content}" for i, d in enumerate(docs))
+        return await llm_structured(
+            AgenticResult,
+            "You are given numbered documents and a question. "
+            "1) List the ids of documents relevant to the question in relevant_ids. "
+            "2) Answer ONLY based on the relevant documents, citing the parts that support your answer; "
+            "if they are insufficient, clearly state what's missing. "
+            "3) Set grounded to whether every claim in your answer is supported by the documents, "
+            "and list any unsupported claims.",
+            f"Question: {query}",
+            context=f"Documents:\n{numbered}",
         )
 
     async def generate(self, query, context):
-        ctx = "\n\n---\n\n".join([d.page_content for d in context])
-        return llm_call(
+        return await llm_call_async(
             "Answer ONLY based on the context. Cite specific parts that support your answer. "
             "If context is insufficient, clearly state what's missing.",
-            f"Context:\n{ctx}\n\nQuestion: {query}"
+            f"Question: {query}",
+            context=format_context(context),
+        )
+
+    async def generate_with_corrections(self, query: str, context: list, unsupported_claims: list[str],
+                                        temperature: float = 0.0) -> str:
+        """Regenerate with the flagged claims spelled out, so the retry drops them
+        instead of sampling the same hallucination again."""
+        claims = "\n".join(f"- {c}" for c in unsupported_claims) or "- (not itemized)"
+        return await llm_call_async(
+            "Answer ONLY based on the context. Cite specific parts that support your answer. "
+            "If context is insufficient, clearly state what's missing. "
+            "A previous answer made claims the context does not support; do not repeat them.",
+            f"Question: {query}\n\nUnsupported claims to drop:\n{claims}",
+            context=format_context(context),
+            temperature=temperature,
         )
 
     async def run(self, query: str, top_k: int = 5) -> dict:
         trace = []  # Full reasoning trace for learning/debugging
-        current_query = query
-
-        for attempt in range(settings.max_agentic_retries):
-            # Retrieve
-            docs = await self.retrieve(current_query, top_k)
-            trace.append({"step": "retrieve", "attempt": attempt + 1,
-                          "query": current_query, "docs_found": len(docs)})
-
-            # Grade
-            relevant, irrelevant = await self.grade_relevance(query, docs)
-            trace.append({"step": "grade", "relevant": len(relevant),
-                          "irrelevant": len(irrelevant)})
-
-            if len(relevant) >= 2 or attempt == settings.max_agentic_retries - 1:
-                break
-
-            # Reformulate
-            current_query = await self.reformulate(current_query, attempt + 1)
-            trace.append({"step": "reformulate", "new_query": current_query})
 
-        # Generate
-        final_docs = relevant if relevant else docs
-        answer = await self.generate(query, final_docs)
-        trace.append({"step": "generate"})
-
-        # Hallucination check
-        hall_check = await self.check_hallucination(answer, final_docs)
-        trace.append({"step": "hallucination_check", **hall_check})
+        # Speculative retries: while the original query is retrieved and graded,
+        # rewrites are already being generated, retrieved and graded in parallel.
+        # If the original query is good enough the speculative branch is cancelled;
+        # otherwise the best-graded result set wins.
+        async def speculate():
+            rewrites = await self.reformulate(query, settings.max_agentic_retries - 1)
+            return rewrites, await self._graded_retrievals(query, rewrites, top_k)
+
+        original = asyncio.create_task(self._graded_retrievals(query, [query], top_k))
+        speculative = asyncio.create_task(speculate())
+        rewrites = []
+        try:
+            attempts = await original
+            if len(attempts[0][2]) >= self.MIN_RELEVANT:
+                speculative.cancel()
+            else:
+                rewrites, extra = await speculative
+                attempts += extra
+        except BaseException:
+            speculative.cancel()
+            raise
+
+        best = 0
+        for i, (q, docs, rel, irr) in enumerate(attempts):
+            if i == 1:
+                trace.append({"step": "reformulate", "new_queries": rewrites})
+            trace.append({"step": "retrieve", "attempt": i + 1, "query": q, "docs_found": len(docs)})
+            trace.append({"step": "grade", "attempt": i + 1, "relevant": len(rel), "irrelevant": len(irr)})
+            if len(rel) > len(attempts[best][2]):
+                best = i
+        _, docs, relevant, _ = attempts[best]
+        trace.append({"step": "select", "attempt": best + 1})
+
+        # Grade + generate + hallucination check, fused into one structured call
+        candidates = relevant if relevant else docs
+        result = await self.answer_and_verify(query, candidates)
+        final_docs = [candidates[i] for i in dict.fromkeys(result.relevant_ids)
+                      if 0 <= i < len(candidates)] or candidates
+        answer = result.answer
+        hall_check = {"grounded": result.grounded, "unsupported_claims": result.unsupported_claims}
+        trace.append({"step": "answer_and_verify", "relevant": len(final_docs), **hall_check})
 
         if not hall_check.get("grounded", True):
-            answer = await self.generate(query, final_docs)
+            answer = await self.generate_with_corrections(
+                query, final_docs, hall_check["unsupported_claims"], temperature=0.0
+            )
             answer += "\n\n[Note: Answer was regenerated after hallucination detection]"
             trace.append({"step": "regenerate"})
 
@@ -101,9 +205,16 @@ class AgenticRAGAgent(BaseRAGAgent):
             "agent": self.name,
             "agent_description": self.description,
             "answer": answer,
-            "sources": [{"content": d.page_content[:300], "metadata": d.metadata} for d in final_docs],
+            "sources": [source_entry(d) for d in final_docs],
             "num_sources": len(final_docs),
             "grounded": hall_check.get("grounded", True),
-            "retrieval_attempts": attempt + 1,
+            "retrieval_attempts": len(attempts),
             "trace": trace,
         }
+
+    async def stream(self, query: str, top_k: int = 5):
+        # The answer comes out of the fused structured call and may still be
+        # regenerated after the grounding check, so it is sent as one chunk.
+        result = await self.run(query, top_k)
+        yield {"type": "token", "text": result["answer"]}
+        yield {"type": "done", **result}
@@ -1,8 +1,49 @@
+import asyncio
 from abc import ABC, abstractmethod
+from contextlib import aclosing
+from typing import AsyncIterator
+from semantic_cache import semantic_cache
+
+
+_PREVIEW_PREFIX = "_prev_"
+_HIDDEN_META = ("parent_content", "window_text", "image_b64_preview")
+
+
+def preview(doc, n: int = 300) -> str:
+    """First n chars of a doc, sliced once and memoized on its metadata — the same
+    preview is used for grading, checks and the response."""
+    return doc.metadata.setdefault(f"{_PREVIEW_PREFIX}{n}", doc.page_content[:n])
+
+
+def source_entry(doc) -> dict:
+    """Response-side view of a source doc: short preview + public metadata."""
+    return {
+        "content": preview(doc),
+        "metadata": {k: v for k, v in doc.metadata.items()
+                     if k not in _HIDDEN_META and not k.startswith(_PREVIEW_PREFIX)},
+    }
+
+
+def doc_key(doc) -> int:
+    """In-process identity for dedup: hashes the full content, so docs sharing a
+    boilerplate header are not conflated the way a prefix slice would be."""
+    return hash(doc.page_content)
+
+
+def format_context(docs: list, sep: str = "\n\n---\n\n") -> str:
+    """Context block for generate prompts. Docs are joined in a canonical (content) order so
+    the same retrieval set always yields a byte-identical, prompt-cacheable prefix."""
+    return "Context:\n" + sep.join(sorted(d.page_content for d in docs))
+
 
 class BaseRAGAgent(ABC):
     name: str = "base"
     description: str = ""
+    # True when run() awaits nothing but blocking calls (sync LLM client, cached_search),
+    # so it stalls the event loop; compare() then runs it on a worker thread instead.
+    # Agents using the shared async clients must stay False: those clients are bound
+    # to the main event loop.
+    blocking: bool = False
 
     @abstractmethod
     async def retrieve(self, query: str, top_k: int = 5) -> list:
@@ -12,17 +53,63 @@ class BaseRAGAgent(ABC):
     async def generate(self, query: str, context: list) -> str:
         pass
 
+    async def generate_stream(self, query: str, context: list) -> AsyncIterator[str]:
+        """Answer text as it is produced. Default: generate()'s whole answer as one chunk."""
+        yield await self.generate(query, context)
+
+    async def stream_answer(self, query: str, context, result: dict) -> AsyncIterator[dict]:
+        """Yield {"type": "token"} events from generate_stream, then a terminal
+        {"type": "done"} event carrying `result` plus the full answer."""
+        parts = []
+        async with aclosing(self.generate_stream(query, context)) as tokens:
+            async for tok in tokens:
+                parts.append(tok)
+                yield {"type": "token", "text": tok}
+        yield {"type": "done", **result, "answer": "".join(parts)}
+
+    async def _cache_lookup(self, query: str, ctx_hash: str):
+        # Blocking agents may be on a worker thread's private loop, where the shared
+        # async embeddings client (bound to the main loop) can't be used
+        if self.blocking:
+            return semantic_cache.lookup(self.name, query, ctx_hash)
+        return await semantic_cache.alookup(self.name, query, ctx_hash)
+
     async def run(self, query: str, top_k: int = 5) -> dict:
         docs = await self.retrieve(query, top_k)
-        answer = await self.generate(query, docs)
+        ctx_hash = semantic_cache.context_hash(docs)
+        answer = await self._cache_lookup(query, ctx_hash)
+        if answer is None:
+            answer = await self.generate(query, docs)
+            semantic_cache.store(self.name, query, ctx_hash, answer)
         return {
             "agent": self.name,
             "agent_description": self.description,
             "answer": answer,
-            "sources": [
-                {"content": d.page_content[:300], "metadata": {k: v for k, v in d.metadata.items()
-                 if k not in ("parent_content", "window_text", "image_b64_preview")}}
-                for d in docs
-            ],
+            "sources": [source_entry(d) for d in docs],
+            "num_sources": len(docs),
+        }
+
+    def run_sync(self, query: str, top_k: int = 5) -> dict:
+        """run() on a private event loop, for calling from a worker thread."""
+        return asyncio.run(self.run(query, top_k))
+
+    async def stream(self, query: str, top_k: int = 5) -> AsyncIterator[dict]:
+        """run() as events, so the client sees tokens before the answer is complete.
+        Sources and other metadata arrive in the terminal "done" event."""
+        docs = await self.retrieve(query, top_k)
+        result = {
+            "agent": self.name,
+            "agent_description": self.description,
+            "sources": [source_entry(d) for d in docs],
             "num_sources": len(docs),
         }
+        ctx_hash = semantic_cache.context_hash(docs)
+        answer = await self._cache_lookup(query, ctx_hash)
+        if answer is not None:
+            yield {"type": "token", "text": answer}
+            yield {"type": "done", **result, "answer": answer}
+            return
+        async for event in self.stream_answer(query, docs, result):
+            if event["type"] == "done":
+                semantic_cache.store(self.name, query, ctx_hash, event["answer"])
+            yield event
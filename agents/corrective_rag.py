@@ -8,11 +8,32 @@ WHAT IT DOES: If local retrieval is poor, falls back to web search.
 WHY LEARN IT: Production RAG must handle knowledge gaps gracefully.
 KEY INSIGHT: Grade retrieval quality. If bad → don't hallucinate, go to the web.
 """
-from agents.base import BaseRAGAgent
-from vectorstore import store_manager
-from llm import llm_call, llm_json
+from agents.base import BaseRAGAgent, format_context, preview, source_entry
+from vectorstore import cached_search
+from llm import llm_call_async, llm_call_stream, llm_json_async
+from langchain.schema import Document
+import asyncio, atexit
 import httpx
 
+# One pooled client for the whole process: keep-alive (and HTTP/2) means repeat
+# fallbacks skip the TCP+TLS handshake to the search API.
+_WEB_CLIENT = httpx.AsyncClient(
+    http2=True,
+    timeout=5.0,
+    limits=httpx.Limits(max_keepalive_connections=32),
+)
+
+
+def _close_web_client():
+    if not _WEB_CLIENT.is_closed:
+        try:
+            asyncio.run(_WEB_CLIENT.aclose())
+        except Exception:
+            pass  # interpreter is exiting; the OS reclaims the sockets anyway
+
+
+atexit.register(_close_web_client)
+
 class CorrectiveRAGAgent(BaseRAGAgent):
     name = "corrective_rag"
     description = "Falls back to web search when local retrieval is insufficient."
@@ -20,14 +41,15 @@ class CorrectiveRAGAgent(BaseRAGAgent):
     COLLECTION = "naive_rag"
 
     async def retrieve(self, query, top_k=5):
-        return store_manager.search(self.COLLECTION, query, k=top_k)
+        # cached_search may embed the query with the sync client: keep that off the loop
+        return await asyncio.to_thread(cached_search, self.COLLECTION, query, k=top_k)
 
     async def assess_retrieval(self, query: str, docs: list) -> str:
         """Returns: 'correct', 'ambiguous', or 'incorrect'."""
         if not docs:
             return "incorrect"
-        ctx = "\n".join([d.page_content[:300] for d in docs[:3]])
-        result = llm_json(
+        ctx = "\n".join([preview(d) for d in docs[:3]])
+        result = await llm_json_async(
             "Assess if these documents can answer the question. "
             "Return: {\"assessment\": \"correct|ambiguous|incorrect\", \"reason\": \"...\"}",
             f"Question: {query}\n\nDocuments:\n{ctx}"
@@ -39,34 +61,42 @@ class CorrectiveRAGAgent(BaseRAGAgent):
         # In production, use Tavily, Serper, or Brave Search API
         # This is a placeholder — replace with your preferred search API
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    "https://api.duckduckgo.com/",
-                    params={"q": query, "format": "json", "no_redirect": 1}
-                )
-                data = response.json()
-                from langchain.schema import Document
-                results = []
-                for item in data.get("RelatedTopics", [])[:3]:
-                    if "Text" in item:
-                        results.append(Document(
-                            page_content=item["Text"],
-                            metadata={"source": "web_search", "url": item.get("FirstURL", "")}
-                        ))
-                return results
+            response = await _WEB_CLIENT.get(
+                "https://api.duckduckgo.com/",
+                params={"q": query, "format": "json", "no_redirect": 1}
+            )
+            data = response.json()
+            results = []
+            for item in data.get("RelatedTopics", [])[:3]:
+                if "Text" in item:
+                    results.append(Document(
+                        page_content=item["Text"],
+                        metadata={"source": "web_search", "url": item.get("FirstURL", "")}
+                    ))
+            return results
         except Exception:
             return []
 
-    async def generate(self, query, context):
-        ctx = "\n\n---\n\n".join([d.page_content for d in context])
+    def _prompt(self, query, context) -> dict:
         sources = set(d.metadata.get("source", "local") for d in context)
-        source_note = " (includes web results)" if "web_search" in sources else ""
-        return llm_call(
-            f"Answer the question using context{source_note}. Clearly indicate if info comes from web search.",
-            f"Context:\n{ctx}\n\nQuestion: {query}"
+        source_note = "\n(Context includes web results.)" if "web_search" in sources else ""
+        # System prompt stays fixed; the per-request web note rides with the question
+        return dict(
+            system="Answer the question using context. Clearly indicate if info comes from web search.",
+            user=f"Question: {query}{source_note}",
+            context=format_context(context),
         )
 
-    async def run(self, query: str, top_k: int = 5) -> dict:
+    async def generate(self, query, context):
+        return await llm_call_async(**self._prompt(query, context))
+
+    async def generate_stream(self, query, context):
+        async for tok in llm_call_stream(**self._prompt(query, context)):
+            yield tok
+
+    async def select_sources(self, query: str, top_k: int) -> tuple[list, dict]:
+        """Retrieve, assess, and fall back to the web as needed.
+        Returns (final_docs, assessment metadata for the response)."""
         docs = await self.retrieve(query, top_k)
         assessment = await self.assess_retrieval(query, docs)
 
@@ -81,13 +111,28 @@ class CorrectiveRAGAgent(BaseRAGAgent):
         else:
             final_docs = docs
 
+        return final_docs, {"retrieval_assessment": assessment, "web_fallback_used": len(web_docs) > 0}
+
+    async def run(self, query: str, top_k: int = 5) -> dict:
+        final_docs, assessment = await self.select_sources(query, top_k)
         answer = await self.generate(query, final_docs)
         return {
             "agent": self.name,
             "agent_description": self.description,
             "answer": answer,
-            "sources": [{"content": d.page_content[:300], "metadata": d.metadata} for d in final_docs],
+            "sources": [source_entry(d) for d in final_docs],
+            "num_sources": len(final_docs),
+            **assessment,
+        }
+
+    async def stream(self, query: str, top_k: int = 5):
+        final_docs, assessment = await self.select_sources(query, top_k)
+        result = {
+            "agent": self.name,
+            "agent_description": self.description,
+            "sources": [source_entry(d) for d in final_docs],
             "num_sources": len(final_docs),
-            "retrieval_assessment": assessment,
-            "web_fallback_used": len(web_docs) > 0,
+            **assessment,
         }
+        async for event in self.stream_answer(query, final_docs, result):
+            yield event
@@ -6,10 +6,28 @@ WHAT IT DOES: Extracts entities/relations into a knowledge graph, traverses for
 WHY LEARN IT: Captures relationships that flat text chunks miss entirely.
 KEY INSIGHT: "Who does X work with?" needs graph traversal, not vector similarity.
 """
-from agents.base import BaseRAGAgent
-from graph_store import KnowledgeGraph
-from vectorstore import store_manager
-from llm import llm_call, llm_json
+from agents.base import BaseRAGAgent, format_context, source_entry
+from graph_store import get_knowledge_graph
+from vectorstore import get_store_manager
+from llm import llm_call_async, llm_call_stream, llm_json_async
+from config import settings
+import asyncio
+
+# Local NER handles query entity extraction in milliseconds, no LLM round-trip.
+# Optional: without spaCy/en_core_web_sm (or with LLM_NER=true) we use the LLM.
+try:
+    import spacy
+    _NLP = spacy.load("en_core_web_sm", disable=["tagger", "parser", "attribute_ruler", "lemmatizer"])
+    _NLP("warm up")  # first call initialises lazy state; pay it at import, not per query
+except (ImportError, OSError):
+    _NLP = None
+
+
+def extract_entities_local(text: str) -> list[str]:
+    if _NLP is None:
+        return []
+    return list(dict.fromkeys(ent.text for ent in _NLP(text).ents))
+
 
 class GraphRAGAgent(BaseRAGAgent):
     name = "graph_rag"
@@ -18,41 +36,61 @@ class GraphRAGAgent(BaseRAGAgent):
     COLLECTION = "naive_rag"  # also uses text store for fallback
 
     def __init__(self):
-        self.kg = KnowledgeGraph()
+        self.kg = get_knowledge_graph()
 
     async def retrieve(self, query, top_k=5):
-        # Step 1: Extract entities from the query
-        result = llm_json(
-            "Extract key entities from this question. Return: {\"entities\": [\"entity1\", \"entity2\"]}",
-            query
-        )
-        entities = result.get("entities", [])
+        # Step 1: Extract entities from the query (locally when possible), and
+        # independently get text chunks for the hybrid approach
+        entities = [] if settings.llm_ner else extract_entities_local(query)
+        if entities:
+            text_docs = await get_store_manager().asearch(self.COLLECTION, query, k=top_k)
+        else:
+            # LLM fallback — overlap its round-trip with the text search
+            result, text_docs = await asyncio.gather(
+                llm_json_async(
+                    "Extract key entities from this question. Return: {\"entities\": [\"entity1\", \"entity2\"]}",
+                    query
+                ),
+                get_store_manager().asearch(self.COLLECTION, query, k=top_k),
+            )
+            entities = result.get("entities", [])
 
         # Step 2: Get subgraph around those entities
         subgraph = self.kg.query_subgraph(entities, depth=2)
 
-        # Step 3: Also get text chunks for hybrid approach
-        text_docs = store_manager.search(self.COLLECTION, query, k=top_k)
-
         return text_docs, subgraph
 
-    async def generate(self, query, context):
+    def _prompt(self, query, context) -> dict:
         # context is (text_docs, subgraph) tuple from retrieve
         text_docs, subgraph = context
-        text_ctx = "\n\n".join([d.page_content for d in text_docs])
+        text_ctx = format_context(text_docs, sep="\n\n")
 
-        graph_ctx = "Knowledge Graph:\n"
-        for node in subgraph.get("nodes", []):
-            graph_ctx += f"  Entity: {node['name']} (type: {node.get('type', '?')}): {node.get('description', '')}\n"
-        for edge in subgraph.get("edges", []):
-            graph_ctx += f"  Relation: {edge['source']} --[{edge.get('relation', '')}]--> {edge['target']}\n"
+        # Collect lines and join once; += on a str copies the whole prefix every time
+        parts = ["Knowledge Graph:\n"]
+        parts.extend(
+            f"  Entity: {node['name']} (type: {node.get('type', '?')}): {node.get('description', '')}\n"
+            for node in subgraph.get("nodes", [])
+        )
+        parts.extend(
+            f"  Relation: {edge['source']} --[{edge.get('relation', '')}]--> {edge['target']}\n"
+            for edge in subgraph.get("edges", [])
+        )
+        graph_ctx = "".join(parts)
 
-        return llm_call(
-            "Answer using both the text context and the knowledge graph. "
+        return dict(
+            system="Answer using both the text context and the knowledge graph. "
             "The graph shows entities and their relationships. Prefer graph data for relationship questions.",
-            f"Text Context:\n{text_ctx}\n\n{graph_ctx}\n\nQuestion: {query}"
+            user=f"Question: {query}",
+            context=f"Text {text_ctx}\n\n{graph_ctx}",
         )
 
+    async def generate(self, query, context):
+        return await llm_call_async(**self._prompt(query, context))
+
+    async def generate_stream(self, query, context):
+        async for tok in llm_call_stream(**self._prompt(query, context)):
+            yield tok
+
     async def run(self, query: str, top_k: int = 5) -> dict:
         text_docs, subgraph = await self.retrieve(query, top_k)
         answer = await self.generate(query, (text_docs, subgraph))
@@ -60,8 +98,19 @@ class GraphRAGAgent(BaseRAGAgent):
             "agent": self.name,
             "agent_description": self.description,
             "answer": answer,
-            "sources": [{"content": d.page_content[:300], "metadata": d.metadata} for d in text_docs],
+            "sources": [source_entry(d) for d in text_docs],
             "graph_context": subgraph,
             "num_sources": len(text_docs),
         }
 
+    async def stream(self, query: str, top_k: int = 5):
+        text_docs, subgraph = await self.retrieve(query, top_k)
+        result = {
+            "agent": self.name,
+            "agent_description": self.description,
+            "sources": [source_entry(d) for d in text_docs],
+            "graph_context": subgraph,
+            "num_sources": len(text_docs),
+        }
+        async for event in self.stream_answer(query, (text_docs, subgraph), result):
+            yield event
@@ -8,11 +8,13 @@ WHAT IT DOES: Combines vector similarity (dense) with BM25 keyword matching (spa
 WHY LEARN IT: Dense misses exact keywords. Sparse misses semantics. Together = best of both.
 KEY INSIGHT: Reciprocal Rank Fusion (RRF) merges two ranked lists into one.
 """
-from agents.base import BaseRAGAgent
-from vectorstore import store_manager
-from bm25_store import BM25Store
+from agents.base import BaseRAGAgent, doc_key, format_context
+from vectorstore import get_store_manager
+from bm25_store import get_bm25_store
 from langchain.schema import Document
-from llm import llm_call
+import asyncio
+import numpy as np
+from llm import llm_call_async, llm_call_stream
 
 class HybridRAGAgent(BaseRAGAgent):
     name = "hybrid_rag"
@@ -21,35 +23,44 @@ class HybridRAGAgent(BaseRAGAgent):
     COLLECTION = "naive_rag"
 
     def __init__(self):
-        self.bm25 = BM25Store("hybrid")
+        self.bm25 = get_bm25_store("hybrid")
 
     def reciprocal_rank_fusion(self, dense: list, sparse: list, k: int = 60) -> list:
         """RRF: score = sum(1 / (k + rank)) across both lists."""
-        scores = {}
-        doc_map = {}
+        docs = dense + sparse
+        if not docs:
+            return []
+        keys = np.fromiter((doc_key(d) for d in docs), dtype=np.int64, count=len(docs))
+        ranks = np.concatenate([np.arange(len(dense)), np.arange(len(sparse))])
 
-        for rank, doc in enumerate(dense):
-            key = doc.page_content[:100]
-            scores[key] = scores.get(key, 0) + 1.0 / (k + rank + 1)
-            doc_map[key] = doc
+        uniq, first, inv = np.unique(keys, return_index=True, return_inverse=True)
+        scores = np.bincount(inv, weights=1.0 / (k + ranks + 1), minlength=len(uniq))
+        doc_map = dict(zip(keys.tolist(), docs))  # later (sparse) duplicate wins, as before
 
-        for rank, doc in enumerate(sparse):
-            key = doc.page_content[:100]
-            scores[key] = scores.get(key, 0) + 1.0 / (k + rank + 1)
-            doc_map[key] = doc
-
-        sorted_keys = sorted(scores.keys(), key=lambda x: scores[x], reverse=True)
-        return [doc_map[k] for k in sorted_keys]
+        # np.unique sorts by key (a per-process hash), so break score ties by first
+        # occurrence explicitly: same ranking as the insertion-ordered dict version
+        order = np.lexsort((first, -scores))
+        return [doc_map[key] for key in uniq[order].tolist()]
 
     async def retrieve(self, query, top_k=5):
-        dense = store_manager.search(self.COLLECTION, query, k=top_k * 2)
-        sparse = self.bm25.search(query, k=top_k * 2)
+        # Dense (embedding API) and sparse (CPU) searches are independent — overlap them
+        dense, sparse = await asyncio.gather(
+            get_store_manager().asearch(self.COLLECTION, query, k=top_k * 2),
+            asyncio.to_thread(self.bm25.search, query, top_k * 2),
+        )
         fused = self.reciprocal_rank_fusion(dense, sparse)
         return fused[:top_k]
 
-    async def generate(self, query, context):
-        ctx = "\n\n---\n\n".join([d.page_content for d in context])
-        return llm_call(
-            "Answer based on context retrieved via hybrid search (semantic + keyword matching).",
-            f"Context:\n{ctx}\n\nQuestion: {query}"
+    def _prompt(self, query, context) -> dict:
+        return dict(
+            system="Answer based on context retrieved via hybrid search (semantic + keyword matching).",
+            user=f"Question: {query}",
+            context=format_context(context),
         )
+
+    async def generate(self, query, context):
+        return await llm_call_async(**self._prompt(query, context))
+
+    async def generate_stream(self, query, context):
+        async for tok in llm_call_stream(**self._prompt(query, context)):
+            yield tok
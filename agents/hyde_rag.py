@@ -8,9 +8,9 @@ WHAT IT DOES: First generates a HYPOTHETICAL answer, then uses it to search.
 WHY LEARN IT: Queries are short. Hypothetical docs are long and semantically rich.
 KEY INSIGHT: Embed the answer you EXPECT to find, not the question itself.
 """
-from agents.base import BaseRAGAgent
-from vectorstore import store_manager
-from llm import llm_call
+from agents.base import BaseRAGAgent, doc_key, format_context
+from vectorstore import get_store_manager
+from llm import llm_call_async, llm_call_stream
 
 class HyDERAGAgent(BaseRAGAgent):
     name = "hyde_rag"
@@ -19,7 +19,7 @@ class HyDERAGAgent(BaseRAGAgent):
     COLLECTION = "naive_rag"
 
     async def generate_hypothesis(self, query: str) -> str:
-        return llm_call(
+        return await llm_call_async(
             "Write a detailed, factual paragraph that would perfectly answer this question. "
             "This will be used for document retrieval, so make it specific and information-dense. "
             "Don't hedge — write as if you know the answer.",
@@ -31,26 +31,33 @@ class HyDERAGAgent(BaseRAGAgent):
         hypothesis = await self.generate_hypothesis(query)
 
         # Step 2: Search using the hypothesis (not the original query!)
-        hyde_results = store_manager.search(self.COLLECTION, hypothesis, k=top_k)
-
-        # Step 3: Also search with original query and merge
-        original_results = store_manager.search(self.COLLECTION, query, k=top_k)
+        # Step 3: ...and with the original query, then merge. Both texts are
+        # embedded in a single batched API call.
+        hyde_results, original_results = await get_store_manager().asearch_many(
+            self.COLLECTION, [hypothesis, query], k=top_k
+        )
 
         # Deduplicate
-        seen = set()
+        seen: set[int] = set()
         merged = []
         for doc in hyde_results + original_results:
-            key = doc.page_content[:100]
+            key = doc_key(doc)
             if key not in seen:
                 seen.add(key)
                 merged.append(doc)
 
         return merged[:top_k]
 
-    async def generate(self, query, context):
-        ctx = "\n\n---\n\n".join([d.page_content for d in context])
-        return llm_call(
-            "Answer using the provided context. Ignore any prior assumptions.",
-            f"Context:\n{ctx}\n\nQuestion: {query}"
+    def _prompt(self, query, context) -> dict:
+        return dict(
+            system="Answer using the provided context. Ignore any prior assumptions.",
+            user=f"Question: {query}",
+            context=format_context(context),
         )
 
+    async def generate(self, query, context):
+        return await llm_call_async(**self._prompt(query, context))
+
+    async def generate_stream(self, query, context):
+        async for tok in llm_call_stream(**self._prompt(query, context)):
+            yield tok
@@ -9,30 +9,39 @@ WHY LEARN IT: Real-world data is multimodal. Interviews ask about this.
 KEY INSIGHT: Convert all modalities to text embeddings, but preserve original modality for generation.
 """
 from agents.base import BaseRAGAgent
-from vectorstore import store_manager
-from llm import llm_call
+from vectorstore import cached_search
+from llm import llm_call, llm_call_stream
 
 class MultimodalRAGAgent(BaseRAGAgent):
     name = "multimodal_rag"
     description = "Handles images and text together. Images are described by vision LLM for retrieval."
+    blocking = True  # run() only makes blocking calls
 
     COLLECTION = "multimodal_rag"
 
     async def retrieve(self, query, top_k=5):
-        return store_manager.search(self.COLLECTION, query, k=top_k)
+        return cached_search(self.COLLECTION, query, k=top_k)
 
-    async def generate(self, query, context):
+    def _prompt(self, query, context) -> dict:
         # Separate text and image sources
         text_parts, image_parts = [], []
-        for doc in context:
+        for doc in sorted(context, key=lambda d: d.page_content):  # canonical order, see format_context
             if doc.metadata.get("modality") == "image":
                 image_parts.append(f"[IMAGE: {doc.page_content}]")  # description
             else:
                 text_parts.append(doc.page_content)
 
         ctx = "\n\n---\n\n".join(text_parts + image_parts)
-        return llm_call(
-            "Answer using the context which may include image descriptions marked with [IMAGE]. "
+        return dict(
+            system="Answer using the context which may include image descriptions marked with [IMAGE]. "
             "Reference visual elements when relevant.",
-            f"Context:\n{ctx}\n\nQuestion: {query}"
+            user=f"Question: {query}",
+            context=f"Context:\n{ctx}",
         )
+
+    async def generate(self, query, context):
+        return llm_call(**self._prompt(query, context))
+
+    async def generate_stream(self, query, context):
+        async for tok in llm_call_stream(**self._prompt(query, context)):
+            yield tok
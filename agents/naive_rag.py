@@ -5,23 +5,30 @@ WHAT IT DOES: Chunk → Embed → Retrieve top-k → Generate
 WHY LEARN IT: This is the foundation. Every other RAG is an improvement over this.
 WEAKNESS: Fixed chunk boundaries lose context. No quality check on retrieval.
 """
-from agents.base import BaseRAGAgent
-from vectorstore import store_manager
-from llm import llm_call
+from agents.base import BaseRAGAgent, format_context
+from vectorstore import cached_search
+from llm import llm_call, llm_call_stream
 
 class NaiveRAGAgent(BaseRAGAgent):
     name = "naive_rag"
     description = "Basic chunk-retrieve-generate. The baseline RAG approach."
+    blocking = True  # run() only makes blocking calls
 
     COLLECTION = "naive_rag"
 
     async def retrieve(self, query, top_k=5):
-        return store_manager.search(self.COLLECTION, query, k=top_k)
+        return cached_search(self.COLLECTION, query, k=top_k)
 
-    async def generate(self, query, context):
-        ctx = "\n\n---\n\n".join([d.page_content for d in context])
-        return llm_call(
-            "Answer based on the context provided. If unsure, say so.",
-            f"Context:\n{ctx}\n\nQuestion: {query}"
+    def _prompt(self, query, context) -> dict:
+        return dict(
+            system="Answer based on the context provided. If unsure, say so.",
+            user=f"Question: {query}",
+            context=format_context(context),
         )
 
+    async def generate(self, query, context):
+        return llm_call(**self._prompt(query, context))
+
+    async def generate_stream(self, query, context):
+        async for tok in llm_call_stream(**self._prompt(query, context)):
+            yield tok
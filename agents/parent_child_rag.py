@@ -6,21 +6,22 @@ WHAT IT DOES: Embeds small child chunks, retrieves parent (larger) chunks.
 WHY LEARN IT: Small chunks = better embedding match. Large parents = complete context.
 KEY INSIGHT: Decouple what you SEARCH from what you SEND to the LLM.
 """
-from agents.base import BaseRAGAgent
-from vectorstore import store_manager
+from agents.base import BaseRAGAgent, format_context
+from vectorstore import cached_search
 from langchain.schema import Document
-from llm import llm_call
+from llm import llm_call, llm_call_stream
 
 class ParentChildRAGAgent(BaseRAGAgent):
     name = "parent_child_rag"
     description = "Searches small child chunks but returns their larger parent documents."
+    blocking = True  # run() only makes blocking calls
 
     CHILD_COLLECTION = "parent_child_rag_children"
     PARENT_COLLECTION = "parent_child_rag_parents"
 
     async def retrieve(self, query, top_k=5):
         # Step 1: Search children (small, precise)
-        children = store_manager.search(self.CHILD_COLLECTION, query, k=top_k * 2)
+        children = cached_search(self.CHILD_COLLECTION, query, k=top_k * 2)
 
         # Step 2: Map back to unique parents (large, complete)
         seen_parents = {}
@@ -35,9 +36,16 @@ class ParentChildRAGAgent(BaseRAGAgent):
 
         return list(seen_parents.values())[:top_k]
 
-    async def generate(self, query, context):
-        ctx = "\n\n---\n\n".join([d.page_content for d in context])
-        return llm_call(
-            "Answer using the full document sections provided as context.",
-            f"Context:\n{ctx}\n\nQuestion: {query}"
+    def _prompt(self, query, context) -> dict:
+        return dict(
+            system="Answer using the full document sections provided as context.",
+            user=f"Question: {query}",
+            context=format_context(context),
         )
+
+    async def generate(self, query, context):
+        return llm_call(**self._prompt(query, context))
+
+    async def generate_stream(self, query, context):
+        async for tok in llm_call_stream(**self._prompt(query, context)):
+            yield tok
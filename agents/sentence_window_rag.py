@@ -8,37 +8,46 @@ WHAT IT DOES: Embeds individual sentences, but returns surrounding window on ret
 WHY LEARN IT: Better precision (match exact sentence) + better context (return window).
 KEY INSIGHT: Embedding small = precise matching. Returning big = better LLM context.
 """
-from agents.base import BaseRAGAgent
-from vectorstore import store_manager
+from agents.base import BaseRAGAgent, format_context
+from vectorstore import cached_search
 from langchain.schema import Document
-from llm import llm_call
+from llm import llm_call, llm_call_stream
 
 class SentenceWindowRAGAgent(BaseRAGAgent):
     name = "sentence_window_rag"
     description = "Embeds sentences, retrieves surrounding window for better context."
+    blocking = True  # run() only makes blocking calls
 
     COLLECTION = "sentence_window_rag"
 
     async def retrieve(self, query, top_k=5):
         # Search matches individual sentences
-        results = store_manager.search(self.COLLECTION, query, k=top_k)
+        results = cached_search(self.COLLECTION, query, k=top_k)
 
         # But we RETURN the surrounding window text
         expanded = []
-        seen_windows = set()
+        seen_windows: set[int] = set()
         for doc in results:
             window = doc.metadata.get("window_text", doc.page_content)
-            if window not in seen_windows:
-                seen_windows.add(window)
+            key = hash(window)
+            if key not in seen_windows:
+                seen_windows.add(key)
                 expanded.append(Document(
                     page_content=window,
                     metadata=doc.metadata,
                 ))
         return expanded
 
-    async def generate(self, query, context):
-        ctx = "\n\n---\n\n".join([d.page_content for d in context])
-        return llm_call(
-            "Answer using the context. Each context block is a window around a relevant sentence.",
-            f"Context:\n{ctx}\n\nQuestion: {query}"
+    def _prompt(self, query, context) -> dict:
+        return dict(
+            system="Answer using the context. Each context block is a window around a relevant sentence.",
+            user=f"Question: {query}",
+            context=format_context(context),
         )
+
+    async def generate(self, query, context):
+        return llm_call(**self._prompt(query, context))
+
+    async def generate_stream(self, query, context):
+        async for tok in llm_call_stream(**self._prompt(query, context)):
+            yield tok
@@ -8,24 +8,71 @@ WHAT IT DOES: For structured data. Retrieves schema, then generates pandas code
 WHY LEARN IT: Standard RAG fails on "what's the average X grouped by Y?" questions.
 KEY INSIGHT: Don't retrieve rows — generate code that queries the data.
 """
-from agents.base import BaseRAGAgent
-from vectorstore import store_manager
+from agents.base import BaseRAGAgent, format_context
+from vectorstore import cached_search
 from llm import llm_call
+from collections import OrderedDict
+from functools import lru_cache
+from types import CodeType
+import builtins, os
 import pandas as pd
 
+# {path: (mtime, DataFrame)} — parsed tables, reused until the file changes on disk
+_DF_CACHE: OrderedDict[str, tuple[float, pd.DataFrame]] = OrderedDict()
+_DF_CACHE_SIZE = 16
+
+
+def load_table(path: str) -> pd.DataFrame:
+    """Read a CSV/Excel file once per modification and serve a copy afterwards
+    (the generated code is free to mutate its df)."""
+    mtime = os.path.getmtime(path)
+    cached = _DF_CACHE.get(path)
+    if cached is None or cached[0] != mtime:
+        if path.endswith(".csv"):
+            df = pd.read_csv(path, engine="pyarrow")
+        else:
+            df = pd.read_excel(path, engine="openpyxl")
+        cached = _DF_CACHE[path] = (mtime, df)
+        while len(_DF_CACHE) > _DF_CACHE_SIZE:
+            _DF_CACHE.popitem(last=False)
+    _DF_CACHE.move_to_end(path)
+    return cached[1].copy()
+
+
+# Globals for generated code, built once. This trims the obvious footguns
+# (file/process access, eval, arbitrary imports); it is not a security sandbox.
+_ALLOWED_IMPORTS = {"pandas", "numpy", "math", "statistics", "datetime", "re", "collections", "itertools"}
+_BLOCKED_BUILTINS = {"open", "exec", "eval", "compile", "input", "breakpoint", "exit", "quit", "help"}
+
+
+def _restricted_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if name.split(".")[0] not in _ALLOWED_IMPORTS:
+        raise ImportError(f"import of '{name}' is not allowed in table code")
+    return builtins.__import__(name, globals, locals, fromlist, level)
+
+
+_RESTRICTED_BUILTINS = {k: v for k, v in vars(builtins).items() if k not in _BLOCKED_BUILTINS}
+_RESTRICTED_BUILTINS["__import__"] = _restricted_import
+_SAFE_GLOBALS = {"pd": pd, "__builtins__": _RESTRICTED_BUILTINS}
+
+
+@lru_cache(maxsize=256)
+def _compile_table_code(code: str) -> CodeType:
+    """Repeat questions tend to produce identical code — skip the parse+compile."""
+    return compile(code, "<table_rag>", "exec")
+
+
 class TableRAGAgent(BaseRAGAgent):
     name = "table_rag"
     description = "Handles structured data (CSV/Excel). Generates pandas code to answer analytical questions."
+    blocking = True  # run() only makes blocking calls
 
     COLLECTION = "table_rag"
 
     async def retrieve(self, query, top_k=5):
         # Always retrieve schema first
-        results = store_manager.search(
-            self.COLLECTION, query, k=top_k,
-            filter_dict=None  # get all types including schema
-        )
-        return results
+        # No metadata filter: get all chunk types including schema
+        return cached_search(self.COLLECTION, query, k=top_k)
 
     async def generate(self, query, context):
         # Find schema chunk and CSV path
@@ -39,10 +86,10 @@ class TableRAGAgent(BaseRAGAgent):
 
         if not csv_path or not schema_doc:
             # Fallback to text-based answer
-            ctx = "\n\n".join([d.page_content for d in context])
             return llm_call(
                 "Answer based on the tabular data in context.",
-                f"Context:\n{ctx}\n\nQuestion: {query}"
+                f"Question: {query}",
+                context=format_context(context, sep="\n\n"),
             )
 
         # Generate pandas code
@@ -63,19 +110,19 @@ Rules:
         # Execute the code safely
         try:
             code_clean = code.replace("```python", "").replace("```", "").strip()
-            df = pd.read_csv(csv_path) if csv_path.endswith(".csv") else pd.read_excel(csv_path)
+            df = load_table(csv_path)
             local_vars = {"df": df, "pd": pd}
-            exec(code_clean, {}, local_vars)
+            exec(_compile_table_code(code_clean), dict(_SAFE_GLOBALS), local_vars)
             result = local_vars.get("result", "No result computed")
 
             return f"**Analysis Result:**\n{result}\n\n**Code Used:**\n```python\n{code_clean}\n```"
 
         except Exception as e:
             # Fallback: use context directly
-            ctx = "\n\n".join([d.page_content for d in context])
             fallback = llm_call(
                 "The code execution failed. Answer based on the data shown in context.",
-                f"Context:\n{ctx}\n\nQuestion: {query}\n\nError: {str(e)}"
+                f"Question: {query}\n\nError: {str(e)}",
+                context=format_context(context, sep="\n\n"),
             )
             return f"{fallback}\n\n[Note: Pandas execution failed: {str(e)}]"
 
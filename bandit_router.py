@@ -25,12 +25,21 @@ WHY THIS IS RL:
 - Policy: UCB1 selection strategy
 - The policy IMPROVES over time as it collects more rewards
 """
-import math, json, time
+import math, time, os, atexit
+from contextlib import ExitStack, contextmanager
+import numpy as np
+import orjson
 from pathlib import Path
 from config import settings
 from threading import Lock
 
-BANDIT_STATE_PATH = settings.base_dir / "bandit_state.json"
+# Snapshot: (category x agent) pulls and reward matrices as one .npz
+BANDIT_STATE_PATH = settings.base_dir / "bandit_state.npz"
+LEGACY_STATE_PATH = settings.base_dir / "bandit_state.json"  # read once to migrate, never written
+# Append-only log of updates since the last snapshot: one small line per feedback
+# instead of rewriting the whole state file every time.
+BANDIT_LOG_PATH = settings.base_dir / "bandit_state.log"
+SNAPSHOT_EVERY = 100  # compact the log into a new snapshot after this many updates
 
 AGENTS = [
     "naive_rag", "sentence_window_rag", "parent_child_rag",
@@ -41,6 +50,14 @@ AGENTS = [
 
 CATEGORIES = ["factual", "analytical", "relational", "procedural", "vague", "visual"]
 
+AGENT_INDEX = {agent: i for i, agent in enumerate(AGENTS)}
+CATEGORY_INDEX = {cat: i for i, cat in enumerate(CATEGORIES)}
+
+# INV_SQRT[n - 1] == 1 / sqrt(n): pull counts are small integers, so the per-arm
+# part of the exploration term is a table gather instead of a sqrt and a divide
+INV_SQRT_SIZE = 65536
+INV_SQRT = np.reciprocal(np.sqrt(np.arange(1, INV_SQRT_SIZE + 1, dtype=np.float64)))
+
 # Smart priors — give the bandit a head start based on what we know
 # Each agent gets a small bonus in categories where it should logically excel
 PRIOR_REWARDS = {
@@ -60,68 +77,171 @@ class BanditRouter:
 
     def __init__(self, exploration_constant: float = 1.41):
         self.C = exploration_constant  # sqrt(2) is theoretically optimal
-        self.lock = Lock()
+        # One lock per category, so feedback for one category never blocks routing in
+        # another. Lock order: category locks (by index) before _log_lock.
+        self._locks = {cat: Lock() for cat in CATEGORIES}
+        self._log_lock = Lock()  # seq, the update log and _pending
 
-        # State: {category: {agent: {"pulls": N, "total_reward": R}}}
+        # State as (category x agent) matrices in CATEGORY_INDEX / AGENT_INDEX order, so UCB
+        # is a single vectorized pass over a row. self.state[category] holds views of the rows:
+        # {category: {"pulls": int64[A], "reward": float64[A], "avg": float64[A]}}
+        self.pulls = self.reward = self.avg = None
         self.state = {}
+        self.totals = {}  # {category: sum of pulls}, maintained incrementally
+        self.seq = 0  # number of updates applied; the snapshot records the seq it covers
+        self._pending = 0  # updates in the log since the last snapshot
+        self.version = 0  # bumped on every state change, so readers can cache derived views
+        self._log = None
         self._load()
+        self._log = open(BANDIT_LOG_PATH, "ab")
+        atexit.register(self.flush)
 
     def _load(self):
-        """Load bandit state from disk."""
+        """Load the last snapshot, then replay the update log on top of it."""
         if BANDIT_STATE_PATH.exists():
-            with open(BANDIT_STATE_PATH, "r") as f:
-                self.state = json.load(f)
+            with np.load(BANDIT_STATE_PATH) as saved:
+                pulls, reward = self._prior_matrices()
+                # Map by name, so adding or reordering agents/categories keeps saved stats
+                rows = [CATEGORY_INDEX.get(c) for c in saved["categories"].tolist()]
+                cols = [AGENT_INDEX.get(a) for a in saved["agents"].tolist()]
+                for si, ci in enumerate(rows):
+                    for sj, aj in enumerate(cols):
+                        if ci is not None and aj is not None:
+                            pulls[ci, aj] = saved["pulls"][si, sj]
+                            reward[ci, aj] = saved["reward"][si, sj]
+                self.seq = int(saved["seq"])
+            self._set_state(pulls, reward)
+        elif LEGACY_STATE_PATH.exists():
+            saved = orjson.loads(LEGACY_STATE_PATH.read_bytes())
+            if "state" not in saved:  # oldest format: the bare {category: {agent: ...}} dict
+                saved = {"seq": 0, "state": saved}
+            pulls, reward = self._prior_matrices()
+            for cat, cat_state in saved["state"].items():
+                for agent, data in cat_state.items():
+                    if cat in CATEGORY_INDEX and agent in AGENT_INDEX:
+                        pulls[CATEGORY_INDEX[cat], AGENT_INDEX[agent]] = data["pulls"]
+                        reward[CATEGORY_INDEX[cat], AGENT_INDEX[agent]] = data["total_reward"]
+            self.seq = saved["seq"]
+            self._set_state(pulls, reward)
+            self._save()
         else:
             self._initialize()
 
+        if BANDIT_LOG_PATH.exists():
+            with open(BANDIT_LOG_PATH, "rb") as f:
+                for line in f:
+                    try:
+                        entry = orjson.loads(line)
+                    except orjson.JSONDecodeError:
+                        break  # torn final line from a crash mid-write
+                    # Entries at or below the snapshot's seq are already in it
+                    if entry["seq"] > self.seq and entry["cat"] in self.state and entry["agent"] in AGENT_INDEX:
+                        self._apply(entry["cat"], AGENT_INDEX[entry["agent"]], entry["r"])
+                        self.seq = entry["seq"]
+                        self._pending += 1
+
     def _save(self):
-        """Persist bandit state."""
-        with open(BANDIT_STATE_PATH, "w") as f:
-            json.dump(self.state, f, indent=2)
+        """Write a snapshot atomically (tmp file + rename), then truncate the update log."""
+        tmp = BANDIT_STATE_PATH.with_suffix(".npz.tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, pulls=self.pulls, reward=self.reward, seq=np.int64(self.seq),
+                     agents=np.array(AGENTS), categories=np.array(CATEGORIES))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, BANDIT_STATE_PATH)
+        if self._log is not None:
+            self._log.truncate(0)
+        self._pending = 0
+
+    @contextmanager
+    def _all_locked(self):
+        """Hold every category lock plus the log lock: a consistent view for snapshots."""
+        with ExitStack() as stack:
+            for cat in CATEGORIES:
+                stack.enter_context(self._locks[cat])
+            stack.enter_context(self._log_lock)
+            yield
+
+    def flush(self):
+        """Snapshot any logged updates (also runs at interpreter exit)."""
+        with self._all_locked():
+            if self._pending:
+                self._save()
+
+    @staticmethod
+    def _prior_matrices() -> tuple[np.ndarray, np.ndarray]:
+        priors = [[PRIOR_REWARDS.get((cat, agent), (1, 0.5)) for agent in AGENTS]  # default: 1 pull, 0.5 reward
+                  for cat in CATEGORIES]
+        return (np.array([[p[0] for p in row] for row in priors], dtype=np.int64),
+                np.array([[p[1] for p in row] for row in priors], dtype=np.float64))
+
+    def _set_state(self, pulls: np.ndarray, reward: np.ndarray):
+        self.pulls, self.reward = pulls, reward
+        self.avg = np.divide(reward, pulls, out=np.zeros_like(reward), where=pulls > 0)
+        self.state = {
+            cat: {"pulls": self.pulls[c], "reward": self.reward[c], "avg": self.avg[c]}
+            for cat, c in CATEGORY_INDEX.items()
+        }
+        self.totals = dict(zip(CATEGORIES, self.pulls.sum(axis=1).tolist()))
 
     def _initialize(self):
         """Initialize with prior knowledge."""
-        self.state = {}
-        for cat in CATEGORIES:
-            self.state[cat] = {}
-            for agent in AGENTS:
-                prior = PRIOR_REWARDS.get((cat, agent), (1, 0.5))  # default: 1 pull, 0.5 reward
-                self.state[cat][agent] = {
-                    "pulls": prior[0],
-                    "total_reward": prior[1],
-                }
+        self._set_state(*self._prior_matrices())
         self._save()
 
-    def select_agent(self, category: str) -> tuple[str, dict]:
+    def arm_stats(self, category: str, agent: str) -> dict:
+        """Stats for one (category, agent) arm, or {} if unknown."""
+        if category not in self.state or agent not in AGENT_INDEX:
+            return {}
+        i = AGENT_INDEX[agent]
+        with self._locks[category]:
+            arms = self.state[category]
+            return {
+                "pulls": int(arms["pulls"][i]),
+                "total_reward": float(arms["reward"][i]),
+                "avg_reward": float(arms["avg"][i]),
+            }
+
+    def select_agent(self, category: str, debug: bool = False) -> tuple[str, dict]:
         """
         Select the best agent for this category using UCB1.
-        Returns (agent_name, debug_info with all scores).
+        Returns (agent_name, info); with debug=True, info also has every arm's scores.
         """
         if category not in self.state:
             category = "factual"  # fallback
 
-        cat_state = self.state[category]
-        total_pulls = sum(a["pulls"] for a in cat_state.values())
+        # Copy-on-read: hold the category lock only long enough to copy the small
+        # row vectors, then score outside it
+        with self._locks[category]:
+            arms = self.state[category]
+            pulls, avg, reward = arms["pulls"].copy(), arms["avg"].copy(), arms["reward"].copy()
+            total_pulls = self.totals[category]
 
-        scores = {}
-        for agent, data in cat_state.items():
-            n = data["pulls"]
-            avg_reward = data["total_reward"] / n if n > 0 else 0
+        # UCB1 formula, all arms at once: C * sqrt(ln t / n). Priors give every arm
+        # n >= 1, so no +1 smoothing is needed; log is computed once, not per arm.
+        log_t = math.log(max(total_pulls, 1))
+        if pulls.max() <= INV_SQRT_SIZE:
+            exploration_bonus = (self.C * math.sqrt(log_t)) * INV_SQRT[pulls - 1]
+        else:
+            exploration_bonus = self.C * np.sqrt(log_t / pulls)
+        ucb = avg + exploration_bonus
 
-            # UCB1 formula
-            exploration_bonus = self.C * math.sqrt(math.log(total_pulls + 1) / (n + 1))
-            ucb_score = avg_reward + exploration_bonus
+        # Select agent with highest UCB score (first one wins ties, as before)
+        best_agent = AGENTS[int(ucb.argmax())]
+        if not debug:
+            return best_agent, {"category": category, "selected": best_agent}
 
-            scores[agent] = {
-                "ucb_score": round(ucb_score, 4),
-                "avg_reward": round(avg_reward, 4),
-                "exploration_bonus": round(exploration_bonus, 4),
+        scores = {
+            agent: {
+                "ucb_score": round(u, 4),
+                "avg_reward": round(a, 4),
+                "exploration_bonus": round(b, 4),
                 "pulls": n,
-                "total_reward": round(data["total_reward"], 2),
+                "total_reward": round(r, 2),
             }
-
-        # Select agent with highest UCB score
-        best_agent = max(scores, key=lambda a: scores[a]["ucb_score"])
+            for agent, u, a, b, n, r in zip(AGENTS, ucb.tolist(), avg.tolist(), exploration_bonus.tolist(),
+                                            pulls.tolist(), reward.tolist())
+        }
 
         return best_agent, {
             "category": category,
@@ -137,63 +257,70 @@ class BanditRouter:
         """
         if category not in self.state:
             return
-        if agent not in self.state[category]:
+        if agent not in AGENT_INDEX:
             return
 
-        with self.lock:
-            self.state[category][agent]["pulls"] += 1
-            self.state[category][agent]["total_reward"] += reward
-            self._save()
+        with self._locks[category]:
+            self._apply(category, AGENT_INDEX[agent], reward)
+            with self._log_lock:
+                self.seq += 1
+                self._log.write(orjson.dumps(
+                    {"seq": self.seq, "cat": category, "agent": agent, "r": reward, "t": time.time()}
+                ) + b"\n")
+                self._log.flush()
+                self._pending += 1
+                self.version += 1
+                snapshot_due = self._pending >= SNAPSHOT_EVERY
+        if snapshot_due:
+            self.flush()
+
+    def _apply(self, category: str, i: int, reward: float):
+        arms = self.state[category]
+        arms["pulls"][i] += 1
+        arms["reward"][i] += reward
+        arms["avg"][i] = arms["reward"][i] / arms["pulls"][i]
+        self.totals[category] += 1
 
     def get_stats(self) -> dict:
         """Get full bandit state with derived metrics."""
-        stats = {}
-        for cat in CATEGORIES:
-            cat_stats = {}
-            for agent in AGENTS:
-                data = self.state.get(cat, {}).get(agent, {"pulls": 0, "total_reward": 0})
-                n = data["pulls"]
-                cat_stats[agent] = {
-                    "pulls": n,
-                    "avg_reward": round(data["total_reward"] / n, 3) if n > 0 else 0,
-                    "total_reward": round(data["total_reward"], 2),
-                }
-            # Sort by avg_reward descending
-            cat_stats = dict(sorted(cat_stats.items(), key=lambda x: x[1]["avg_reward"], reverse=True))
-            stats[cat] = cat_stats
-        return stats
+        with self._all_locked():
+            pulls = self.pulls.copy()
+            avg = np.round(self.avg, 3)
+            reward = np.round(self.reward, 2)
+        # Per category, agents by avg_reward descending (stable, so ties keep AGENTS order)
+        order = np.argsort(-avg, axis=1, kind="stable")
+
+        pulls, avg, reward, order = pulls.tolist(), avg.tolist(), reward.tolist(), order.tolist()
+        return {
+            cat: {
+                AGENTS[i]: {"pulls": pulls[c][i], "avg_reward": avg[c][i], "total_reward": reward[c][i]}
+                for i in order[c]
+            }
+            for c, cat in enumerate(CATEGORIES)
+        }
 
     def get_leaderboard(self) -> list[dict]:
         """Ranked list of agents with overall performance."""
-        agent_totals = {a: {"pulls": 0, "reward": 0, "categories_won": 0} for a in AGENTS}
-
-        for cat in CATEGORIES:
-            best_avg = 0
-            best_agent = None
-            for agent in AGENTS:
-                data = self.state.get(cat, {}).get(agent, {"pulls": 0, "total_reward": 0})
-                agent_totals[agent]["pulls"] += data["pulls"]
-                agent_totals[agent]["reward"] += data["total_reward"]
-                avg = data["total_reward"] / data["pulls"] if data["pulls"] > 0 else 0
-                if avg > best_avg:
-                    best_avg = avg
-                    best_agent = agent
-            if best_agent:
-                agent_totals[best_agent]["categories_won"] += 1
-
-        leaderboard = []
-        for agent, totals in agent_totals.items():
-            n = totals["pulls"]
-            leaderboard.append({
-                "agent": agent,
-                "total_interactions": n,
-                "avg_reward": round(totals["reward"] / n, 3) if n > 0 else 0,
-                "categories_won": totals["categories_won"],
-            })
+        with self._all_locked():
+            pulls = self.pulls.sum(axis=0)
+            reward = self.reward.sum(axis=0)
+            cat_avg = self.avg.copy()
+        avg = np.divide(reward, pulls, out=np.zeros_like(reward), where=pulls > 0)
 
+        # A category is won by its best-average agent (first on ties), if that average is > 0
+        best = cat_avg.argmax(axis=1)
+        won = best[cat_avg.max(axis=1) > 0]
+        categories_won = np.bincount(won, minlength=len(AGENTS))
+
+        leaderboard = [
+            {"agent": agent, "total_interactions": n, "avg_reward": round(a, 3), "categories_won": w}
+            for agent, n, a, w in zip(AGENTS, pulls.tolist(), avg.tolist(), categories_won.tolist())
+        ]
         leaderboard.sort(key=lambda x: x["avg_reward"], reverse=True)
         return leaderboard
 
     def reset(self):
         """Reset bandit to initial priors."""
-        self._initialize()
\ No newline at end of file
+        with self._all_locked():
+            self._initialize()
+            self.version += 1
\ No newline at end of file
@@ -4,18 +4,41 @@
 """
 Sparse retrieval (BM25) for Hybrid RAG.
 LEARNING: Dense embeddings miss exact keyword matches. BM25 catches them.
+Backed by bm25s: the index is a SciPy sparse matrix scored with vectorized NumPy,
+and it is persisted to disk so startup doesn't re-index the corpus.
 """
-from rank_bm25 import BM25Okapi
+import bm25s
+import numpy as np
 from langchain.schema import Document
-import pickle, os
+from functools import lru_cache
+import pickle, os, re
+from threading import Lock
 from config import settings
 
+# Word tokens, so "retrieval," and "(BM25)" match "retrieval" and "bm25".
+# TOKENIZER is stored with the corpus; a mismatch means the tokens must be redone.
+_TOKEN_RE = re.compile(r"\w+")
+TOKENIZER = "regex-w+"
+
+
+def _tokenize(text: str) -> list[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+@lru_cache(maxsize=1024)
+def _tokenize_query(query: str) -> tuple[str, ...]:
+    """Repeat queries skip the regex pass."""
+    return tuple(_tokenize(query))
+
 class BM25Store:
     def __init__(self, name: str):
         self.name = name
         self.path = settings.base_dir / f"bm25_{name}.pkl"
+        self.index_dir = settings.base_dir / f"bm25_{name}_index"
         self.documents: list[Document] = []
-        self.bm25: BM25Okapi | None = None
+        self.tokenized: list[list[str]] = []  # parallel to documents; only new docs get tokenized
+        self.bm25: bm25s.BM25 | None = None
+        self._lock = Lock()  # add_documents may run in a worker thread during /upload
         self._load()
 
     def _load(self):
@@ -23,27 +46,53 @@ class BM25Store:
             with open(self.path, "rb") as f:
                 data = pickle.load(f)
                 self.documents = data["docs"]
+            if data.get("tokenizer") == TOKENIZER:
+                self.tokenized = data["tokenized"]
+                if self.index_dir.exists():
+                    self.bm25 = bm25s.BM25.load(str(self.index_dir), show_progress=False)
+            else:
+                # Saved before tokens were persisted, or with a different tokenizer
+                self.tokenized = [_tokenize(d.page_content) for d in self.documents]
+            # No usable saved index, or an interrupted save left it stale
+            if self.bm25 is None or self.bm25.scores["num_docs"] != len(self.documents):
                 self._rebuild_index()
+                self._save()
 
     def _save(self):
         with open(self.path, "wb") as f:
-            pickle.dump({"docs": self.documents}, f)
+            pickle.dump({"docs": self.documents, "tokenized": self.tokenized, "tokenizer": TOKENIZER}, f)
+        if self.bm25 is not None:
+            self.bm25.save(str(self.index_dir), show_progress=False)
 
     def _rebuild_index(self):
-        if self.documents:
-            tokenized = [d.page_content.lower().split() for d in self.documents]
-            self.bm25 = BM25Okapi(tokenized)
+        # bm25s has no incremental add, but re-indexing cached tokens skips
+        # re-tokenizing the whole corpus — the bulk of the cost on long docs
+        if self.tokenized:
+            self.bm25 = bm25s.BM25()
+            self.bm25.index(self.tokenized, show_progress=False)
 
     def add_documents(self, docs: list[Document]):
-        self.documents.extend(docs)
-        self._rebuild_index()
-        self._save()
+        with self._lock:
+            self.documents.extend(docs)
+            self.tokenized.extend(_tokenize(d.page_content) for d in docs)
+            self._rebuild_index()
+            self._save()
 
     def search(self, query: str, k: int = 5) -> list[Document]:
-        if not self.bm25:
+        tokenized_query = _tokenize_query(query)
+        if not self.bm25 or not tokenized_query or k <= 0:
             return []
-        tokenized_query = query.lower().split()
-        scores = self.bm25.get_scores(tokenized_query)
-        top_indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:k]
-        return [self.documents[i] for i in top_indices if scores[i] > 0]
+        scores = self.bm25.get_scores(list(tokenized_query))
+        # O(N) partial selection of the top k, then sort just those k
+        k = min(k, len(scores))
+        top_indices = np.argpartition(-scores, k - 1)[:k]
+        top_indices = top_indices[np.argsort(-scores[top_indices], kind="stable")]
+        # Copies: callers annotate metadata, which must not leak into the persisted corpus
+        return [Document(page_content=self.documents[i].page_content, metadata=dict(self.documents[i].metadata))
+                for i in top_indices if scores[i] > 0]
+
 
+@lru_cache(maxsize=None)
+def get_bm25_store(name: str) -> BM25Store:
+    """One store per name per process: agents and /upload share the loaded index."""
+    return BM25Store(name)
@@ -1,5 +1,6 @@
 # ======================== FILE: config.py ========================
 import os
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
 
@@ -33,9 +34,25 @@ class Settings(BaseSettings):
     relevance_threshold: float = 0.7
     max_agentic_retries: int = 3
 
+    # Graph RAG: use the LLM instead of local spaCy NER for query entities
+    llm_ner: bool = False
+
+    # Generation
+    semantic_cache_threshold: float = 0.92  # cosine similarity for reusing a cached answer
+    semantic_cache_sq8: bool = True  # keep cached query vectors as int8 (4x smaller)
+
     class Config:
         env_file = ".env"
 
-settings = Settings()
-for d in [settings.upload_dir, settings.chroma_dir]:
-    d.mkdir(parents=True, exist_ok=True)
\ No newline at end of file
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """The one Settings instance: env/.env are read and validated, and the data
+    directories created, once per process."""
+    s = Settings()
+    for d in [s.upload_dir, s.chroma_dir]:
+        d.mkdir(parents=True, exist_ok=True)
+    return s
+
+
+settings = get_settings()
\ No newline at end of file
@@ -1,12 +1,32 @@
 
 # ======================== FILE: embeddings.py ========================
+from functools import lru_cache
+import numpy as np
 from langchain_openai import OpenAIEmbeddings
 from config import settings
 
 
+@lru_cache(maxsize=1)
 def get_embeddings():
+    """Shared client: one construction, and one HTTP connection pool reused by every caller."""
     # Pass API key explicitly so we do not rely on environment variable loading
     return OpenAIEmbeddings(
         model=settings.embedding_model,
         api_key=settings.openai_api_key,
     )
+
+
+def quantize_sq8(vecs) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Scalar-quantize float vectors to int8, one (scale, zero) pair per vector:
+    vec ~= q * scale + zero. Returns (int8[N, D], scale[N], zero[N])."""
+    vecs = np.atleast_2d(np.asarray(vecs, dtype=np.float32))
+    lo, hi = vecs.min(axis=1), vecs.max(axis=1)
+    scale = (hi - lo) / 255.0
+    scale[scale == 0] = 1.0  # constant vector: any scale reproduces it
+    q = np.rint((vecs - lo[:, None]) / scale[:, None]) - 128
+    return q.astype(np.int8), scale, (lo + 128 * scale).astype(np.float32)
+
+
+def dequantize_sq8(q: np.ndarray, scale: np.ndarray, zero: np.ndarray) -> np.ndarray:
+    """Inverse of quantize_sq8 (up to rounding error): float32[N, D]."""
+    return q.astype(np.float32) * scale[:, None] + zero[:, None]
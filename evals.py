@@ -1,16 +1,20 @@
 import argparse
 import asyncio
 import json
+import orjson
 from pathlib import Path
 from typing import List, Dict, Any
 
 from rl_orchestrator import RLOrchestrator
-from llm import llm_call
+from llm import llm_call, parse_json
 
 
 EVAL_DIR = Path("data/eval")
 EVAL_QUERIES_PATH = EVAL_DIR / "queries.jsonl"
 
+# Keys agents use for their answer text, in priority order
+ANSWER_KEYS = ("answer", "response", "output", "content")
+
 
 def load_eval_queries(max_questions: int | None = None) -> List[Dict[str, Any]]:
     """
@@ -19,13 +23,14 @@ def load_eval_queries(max_questions: int | None = None) -> List[Dict[str, Any]]:
     """
     if EVAL_QUERIES_PATH.exists():
         queries: List[Dict[str, Any]] = []
-        with open(EVAL_QUERIES_PATH, "r") as f:
+        with open(EVAL_QUERIES_PATH, "rb") as f:
             for line in f:
+                # Stop reading once we have enough, rather than parsing the whole file
+                if max_questions is not None and len(queries) >= max_questions:
+                    break
                 if not line.strip():
                     continue
-                queries.append(json.loads(line))
-        if max_questions is not None:
-            queries = queries[:max_questions]
+                queries.append(orjson.loads(line))
         return queries
 
     demo = [
@@ -57,53 +62,96 @@ async def run_agents(
     return result.get("comparisons", {})
 
 
-def judge_with_llm(question: str, answers: Dict[str, str]) -> Dict[str, Any]:
+def judge_batch(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
-    Use the primary LLM as a judge to score each agent's answer.
-
-    Returns structure:
-      {
-        "scores": {agent: float 0-1},
-        "winner": "<agent-name>",
-        "explanation": "natural language rationale"
-      }
+    Use the primary LLM as a judge to score each agent's answer, several questions
+    per call so the instructions and per-call overhead are paid once per batch.
+
+    items: [{"question": str, "answers": {agent: text}}, ...]
+    Returns one verdict per item, in order.
     """
     system = (
         "You are an impartial evaluator for a retrieval-augmented QA system. "
-        "You will be given a user question and multiple agent answers. "
+        "You will be given several numbered items, each a user question and multiple agent answers. "
         "Score each answer between 0.0 (useless / wrong) and 1.0 (fully correct, concise, well grounded). "
-        "Prefer answers that are specific, grounded, and honest about uncertainty."
+        "Prefer answers that are specific, grounded, and honest about uncertainty. "
+        "Judge every item independently."
     )
 
-    answers_block = "\n\n".join(
-        [f"[{agent}]\n{text}" for agent, text in answers.items()]
-    )
+    blocks = []
+    for i, item in enumerate(items):
+        answers_block = "\n\n".join(
+            [f"[{agent}]\n{text}" for agent, text in item["answers"].items()]
+        )
+        blocks.append(f"### Item {i}\nQuestion:\n{item['question']}\n\nAgent answers:\n{answers_block}")
+    items_block = "\n\n".join(blocks)
 
     user = f"""
-Question:
-{question}
+{items_block}
 
-Agent answers:
-{answers_block}
-
-Respond in JSON with the following schema:
+Respond in JSON with the following schema, one verdict per item, preserving item order:
 {{
-  "scores": {{"<agent>": 0.0-1.0, ...}},
-  "winner": "<agent-with-highest-score>",
-  "explanation": "brief natural language explanation"
+  "verdicts": [
+    {{
+      "scores": {{"<agent>": 0.0-1.0, ...}},
+      "winner": "<agent-with-highest-score>",
+      "explanation": "brief natural language explanation"
+    }},
+    ...
+  ]
 }}
 """
     raw = llm_call(system, user, json_mode=True)
     try:
-        parsed = json.loads(raw)
-    except json.JSONDecodeError:
-        # Fallback: if something went wrong, assign equal scores
-        return {
-            "scores": {a: 0.5 for a in answers.keys()},
-            "winner": sorted(answers.keys())[0],
-            "explanation": "Fallback scoring: JSON parsing failed.",
-        }
-    return parsed
+        verdicts = parse_json(raw).get("verdicts", [])
+    except (json.JSONDecodeError, AttributeError):
+        verdicts = []
+
+    results = []
+    for i, item in enumerate(items):
+        verdict = verdicts[i] if i < len(verdicts) else None
+        if not isinstance(verdict, dict):
+            # Fallback: missing or malformed verdict, assign equal scores
+            verdict = {
+                "scores": {a: 0.5 for a in item["answers"].keys()},
+                "winner": sorted(item["answers"].keys())[0] if item["answers"] else None,
+                "explanation": "Fallback scoring: no verdict returned for this item.",
+            }
+        results.append(verdict)
+    return results
+
+
+async def evaluate_question(
+    orchestrator: RLOrchestrator,
+    q: Dict[str, Any],
+    agents: List[str],
+    top_k: int,
+) -> Dict[str, Any]:
+    """
+    Run the agents on one eval question and collect their answers.
+    """
+    qid = q.get("id") or q.get("name") or q.get("question")[:32]
+    question = q["question"]
+
+    comps = await run_agents(orchestrator, question, agents, top_k)
+
+    # Extract plain-text answers (best-effort: fall back to str(result))
+    answers: Dict[str, str] = {}
+    for name, payload in comps.items():
+        if isinstance(payload, dict):
+            # `in`, not truthiness: an empty-string answer is still the answer
+            text = next((payload[k] for k in ANSWER_KEYS if k in payload), None)
+            if text is None:
+                text = orjson.dumps(payload, default=str).decode()
+        else:
+            text = str(payload)
+        answers[name] = text
+
+    return {
+        "id": qid,
+        "question": question,
+        "answers": answers,
+    }
 
 
 async def run_eval(
@@ -111,54 +159,36 @@ async def run_eval(
     top_k: int,
     max_questions: int | None,
     judge: str,
+    concurrency: int = 8,
+    judge_batch_size: int = 5,
 ) -> Dict[str, Any]:
     """
     Core offline evaluation loop.
+    Questions run concurrently, at most `concurrency` at a time; with the LLM judge,
+    answers are then judged `judge_batch_size` questions per call.
     """
     orchestrator = RLOrchestrator()
     queries = load_eval_queries(max_questions)
+    sem = asyncio.Semaphore(concurrency)
 
-    results: List[Dict[str, Any]] = []
-
-    for q in queries:
-        qid = q.get("id") or q.get("name") or q.get("question")[:32]
-        question = q["question"]
-
-        comps = await run_agents(orchestrator, question, agents, top_k)
-
-        # Extract plain-text answers (best-effort: fall back to str(result))
-        answers: Dict[str, str] = {}
-        for name, payload in comps.items():
-            if isinstance(payload, dict):
-                text = (
-                    payload.get("answer")
-                    or payload.get("response")
-                    or payload.get("output")
-                    or payload.get("content")
-                    or json.dumps(payload)
-                )
-            else:
-                text = str(payload)
-            answers[name] = text
-
-        if judge == "none":
-            results.append(
-                {
-                    "id": qid,
-                    "question": question,
-                    "answers": answers,
-                }
-            )
-        else:
-            judged = judge_with_llm(question, answers)
-            results.append(
-                {
-                    "id": qid,
-                    "question": question,
-                    "answers": answers,
-                    "judgement": judged,
-                }
-            )
+    async def evaluate(q: Dict[str, Any]) -> Dict[str, Any]:
+        async with sem:
+            return await evaluate_question(orchestrator, q, agents, top_k)
+
+    # gather keeps results in question order
+    results: List[Dict[str, Any]] = await asyncio.gather(*[evaluate(q) for q in queries])
+
+    if judge != "none":
+        async def judge_chunk(chunk: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+            async with sem:
+                # judge_batch is a blocking call; keep it off the event loop
+                return await asyncio.to_thread(judge_batch, chunk)
+
+        chunks = [results[i:i + judge_batch_size] for i in range(0, len(results), judge_batch_size)]
+        verdicts = await asyncio.gather(*[judge_chunk(c) for c in chunks])
+        for chunk, chunk_verdicts in zip(chunks, verdicts):
+            for r, verdict in zip(chunk, chunk_verdicts):
+                r["judgement"] = verdict
 
     # Aggregate simple statistics
     summary: Dict[str, Any] = {
@@ -226,6 +256,18 @@ def main():
         default="none",
         help="Evaluation mode: 'none' for raw outputs only, 'llm' to use LLM-as-a-judge.",
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="Maximum number of questions evaluated at once.",
+    )
+    parser.add_argument(
+        "--judge-batch-size",
+        type=int,
+        default=5,
+        help="Questions per LLM judge call (with --judge llm).",
+    )
     parser.add_argument(
         "--output",
         type=str,
@@ -244,16 +286,18 @@ def main():
             top_k=args.top_k,
             max_questions=args.max_questions,
             judge=args.judge,
+            concurrency=args.concurrency,
+            judge_batch_size=args.judge_batch_size,
         )
     )
 
     output_path = Path(args.output)
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(output_path, "w") as f:
-        json.dump(result, f, indent=2)
+    with open(output_path, "wb") as f:
+        f.write(orjson.dumps(result, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
 
     print("=== EVAL SUMMARY ===")
-    print(json.dumps(result["summary"], indent=2))
+    print(orjson.dumps(result["summary"], option=orjson.OPT_INDENT_2).decode())
     print(f"\nFull results written to: {output_path}")
 
 
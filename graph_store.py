@@ -5,72 +5,173 @@ Knowledge graph for Graph RAG.
 LEARNING: Entities + relationships capture structure that flat chunks miss.
 """
 import networkx as nx
+from networkx.readwrite import json_graph
+import orjson
+import os, atexit, asyncio
 import pickle
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import lru_cache
+from threading import RLock
 from config import settings
-from llm import llm_json
+from llm import llm_json, llm_json_async
+
+EXTRACT_CHARS = 3000  # text per extraction call, to avoid token overflow
+
+EXTRACT_PROMPT = """Extract entities and relationships from this text.
+Return JSON: {
+  "entities": [{"name": "...", "type": "person|org|concept|location|event", "description": "..."}],
+  "relationships": [{"source": "...", "target": "...", "relation": "...", "description": "..."}]
+}
+Extract ALL meaningful entities and relationships. Be thorough."""
 
 class KnowledgeGraph:
     def __init__(self):
-        self.path = settings.base_dir / "knowledge_graph.pkl"
+        self.path = settings.base_dir / "knowledge_graph.json"
+        self.legacy_path = settings.base_dir / "knowledge_graph.pkl"  # read once to migrate
         self.graph = nx.DiGraph()
+        # word token -> node names containing it, so entity lookup doesn't scan every node
+        self._token_index: dict[str, set[str]] = defaultdict(set)
+        # Per instance (not a method decorator) so the cache dies with the graph
+        self._match_entity = lru_cache(maxsize=4096)(self._match_entity_uncached)
+        self._dirty = False  # unsaved changes
+        # Guards the graph and token index: /upload merges extractions while
+        # queries read. Reentrant because flush() and batch merges call _save() under it.
+        self._lock = RLock()
+        self._batch_depth = 0  # inside batch(): defer saves to the end
         self._load()
+        atexit.register(self.flush)
 
     def _load(self):
+        # Adjacency JSON: plain data, fast with orjson, and loading it can't run code
         if self.path.exists():
-            with open(self.path, "rb") as f:
+            data = orjson.loads(self.path.read_bytes())
+            self.graph = json_graph.adjacency_graph(data, directed=True)
+        elif self.legacy_path.exists():
+            with open(self.legacy_path, "rb") as f:
                 self.graph = pickle.load(f)
+            self._save()
+        for node in self.graph.nodes:
+            self._index_node(node)
+
+    def _index_node(self, name: str):
+        for tok in name.split():
+            self._token_index[tok].add(name)
+
+    def _match_entity_uncached(self, entity_lower: str) -> frozenset[str]:
+        """Fuzzy match: nodes containing the entity name, or contained in it.
+        Only nodes sharing a word with the entity are candidates."""
+        candidates = set().union(*(self._token_index.get(tok, ()) for tok in entity_lower.split()))
+        return frozenset(n for n in candidates if entity_lower in n or n in entity_lower)
 
     def _save(self):
-        with open(self.path, "wb") as f:
-            pickle.dump(self.graph, f)
+        with self._lock:
+            tmp = self.path.with_suffix(".json.tmp")
+            with open(tmp, "wb") as f:
+                f.write(orjson.dumps(json_graph.adjacency_data(self.graph)))
+            os.replace(tmp, self.path)
+            self._dirty = False
+
+    def flush(self):
+        """Save if there are unsaved changes."""
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    @contextmanager
+    def batch(self):
+        """Group many extract_and_add calls into one save:
+            with kg.batch():
+                for text, src in docs: kg.extract_and_add(text, src)
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self.flush()
 
     def extract_and_add(self, text: str, source: str):
         """Use LLM to extract entities and relationships from text."""
         result = llm_json(
-            system="""Extract entities and relationships from this text.
-Return JSON: {
-  "entities": [{"name": "...", "type": "person|org|concept|location|event", "description": "..."}],
-  "relationships": [{"source": "...", "target": "...", "relation": "...", "description": "..."}]
-}
-Extract ALL meaningful entities and relationships. Be thorough.""",
-            user=text[:3000]  # limit to avoid token overflow
+            system=EXTRACT_PROMPT,
+            user=text[:EXTRACT_CHARS]
         )
+        self._add_extraction(result, source)
+        if not self._batch_depth:
+            self._save()
+
+    async def extract_and_add_batch(self, texts: list[tuple[str, str]], concurrency: int = 8) -> int:
+        """Extract from many (text, source) pairs concurrently, then merge and save once.
+        A document whose extraction fails is skipped. Returns how many were added."""
+        sem = asyncio.Semaphore(concurrency)
+
+        async def extract(text: str) -> dict:
+            async with sem:
+                return await llm_json_async(EXTRACT_PROMPT, text[:EXTRACT_CHARS])
+
+        results = await asyncio.gather(*[extract(text) for text, _ in texts], return_exceptions=True)
 
-        for entity in result.get("entities", []):
-            self.graph.add_node(
-                entity["name"].lower(),
-                type=entity.get("type", "unknown"),
-                description=entity.get("description", ""),
-                source=source,
-            )
-
-        for rel in result.get("relationships", []):
-            self.graph.add_edge(
-                rel["source"].lower(),
-                rel["target"].lower(),
-                relation=rel.get("relation", "related_to"),
-                description=rel.get("description", ""),
-                source=source,
-            )
-        self._save()
+        # Merge in input order, after all calls finish: the graph is only touched here
+        added = 0
+        with self.batch():
+            for (_, source), result in zip(texts, results):
+                if isinstance(result, Exception):
+                    continue
+                self._add_extraction(result, source)
+                added += 1
+        return added
+
+    def _add_extraction(self, result: dict, source: str):
+        """Add one extraction result's entities and relationships to the graph."""
+        with self._lock:
+            for entity in result.get("entities", []):
+                self.graph.add_node(
+                    entity["name"].lower(),
+                    type=entity.get("type", "unknown"),
+                    description=entity.get("description", ""),
+                    source=source,
+                )
+
+            for rel in result.get("relationships", []):
+                self.graph.add_edge(
+                    rel["source"].lower(),
+                    rel["target"].lower(),
+                    relation=rel.get("relation", "related_to"),
+                    description=rel.get("description", ""),
+                    source=source,
+                )
+
+            # Edges can create nodes too, so index everything the result touched
+            for entity in result.get("entities", []):
+                self._index_node(entity["name"].lower())
+            for rel in result.get("relationships", []):
+                self._index_node(rel["source"].lower())
+                self._index_node(rel["target"].lower())
+            self._match_entity.cache_clear()
+            self._dirty = True
 
     def query_subgraph(self, entities: list[str], depth: int = 2) -> dict:
         """Get subgraph around entities up to N hops."""
-        relevant_nodes = set()
-        for entity in entities:
-            entity_lower = entity.lower()
-            # Fuzzy match: find nodes containing the entity name
-            matches = [n for n in self.graph.nodes if entity_lower in n or n in entity_lower]
-            for match in matches:
-                # BFS up to `depth` hops
-                for d in range(depth + 1):
-                    neighbors = nx.single_source_shortest_path_length(self.graph, match, cutoff=d)
+        with self._lock:
+            relevant_nodes = set()
+            for entity in entities:
+                for match in self._match_entity(entity.lower()):
+                    # One BFS up to `depth` hops (cutoff includes every shallower level)
+                    neighbors = nx.single_source_shortest_path_length(self.graph, match, cutoff=depth)
                     relevant_nodes.update(neighbors.keys())
 
-        subgraph = self.graph.subgraph(relevant_nodes)
-        nodes = [{"name": n, **self.graph.nodes[n]} for n in subgraph.nodes]
-        edges = [{"source": u, "target": v, **d} for u, v, d in subgraph.edges(data=True)]
-        return {"nodes": nodes, "edges": edges, "node_count": len(nodes), "edge_count": len(edges)}
+            subgraph = self.graph.subgraph(relevant_nodes)
+            nodes = [{"name": n, **self.graph.nodes[n]} for n in subgraph.nodes]
+            edges = [{"source": u, "target": v, **d} for u, v, d in subgraph.edges(data=True)]
+            return {"nodes": nodes, "edges": edges, "node_count": len(nodes), "edge_count": len(edges)}
 
     def get_stats(self) -> dict:
         return {"nodes": self.graph.number_of_nodes(), "edges": self.graph.number_of_edges()}
+
+
+@lru_cache(maxsize=1)
+def get_knowledge_graph() -> KnowledgeGraph:
+    """The shared graph: loaded once, used by graph_rag and updated by /upload."""
+    return KnowledgeGraph()
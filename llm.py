@@ -30,35 +30,98 @@ Run: uvicorn main:app --reload --port 8000
 
 
 # ======================== FILE: llm.py ========================
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 from config import settings
+from pydantic import BaseModel
+from typing import AsyncIterator, TypeVar
 import json
+import orjson
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
 
 client = OpenAI(api_key=settings.openai_api_key)
+aclient = AsyncOpenAI(api_key=settings.openai_api_key)
 
-def llm_call(system: str, user: str, json_mode: bool = False, model: str = None) -> str:
-    """Unified LLM call helper."""
+def _chat_kwargs(system: str, user: str, json_mode: bool, model: str = None,
+                 context: str = None, temperature: float = None) -> dict:
+    # Order is [system][context][user]: the long retrieved context sits in its own
+    # message ahead of the short question, so repeated contexts share a byte-identical
+    # prefix that the provider's automatic prompt cache can reuse.
+    messages = [{"role": "system", "content": system}]
+    if context is not None:
+        messages.append({"role": "user", "content": context})
+    messages.append({"role": "user", "content": user})
     kwargs = {
         "model": model or settings.llm_model,
-        "messages": [
-            {"role": "system", "content": system},
-            {"role": "user", "content": user},
-        ],
+        "messages": messages,
     }
+    if temperature is not None:
+        kwargs["temperature"] = temperature
     if json_mode:
         kwargs["response_format"] = {"type": "json_object"}
         kwargs["messages"][0]["content"] += " Respond in JSON."
-    response = client.chat.completions.create(**kwargs)
+    return kwargs
+
+def llm_call(system: str, user: str, json_mode: bool = False, model: str = None,
+             context: str = None, temperature: float = None) -> str:
+    """Unified LLM call helper. Pass retrieved docs as `context` to keep them cacheable."""
+    response = client.chat.completions.create(
+        **_chat_kwargs(system, user, json_mode, model, context, temperature)
+    )
+    return response.choices[0].message.content
+
+async def llm_call_async(system: str, user: str, json_mode: bool = False, model: str = None,
+                         context: str = None, temperature: float = None) -> str:
+    """Non-blocking llm_call — lets agents fan out independent calls with asyncio.gather."""
+    response = await aclient.chat.completions.create(
+        **_chat_kwargs(system, user, json_mode, model, context, temperature)
+    )
     return response.choices[0].message.content
 
+async def llm_call_stream(system: str, user: str, model: str = None,
+                          context: str = None) -> AsyncIterator[str]:
+    """Yield response text deltas as they arrive. Wrap in contextlib.aclosing when
+    the consumer may stop early, so the HTTP stream is released right away."""
+    stream = await aclient.chat.completions.create(
+        **_chat_kwargs(system, user, False, model, context), stream=True
+    )
+    try:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        await stream.close()
+
+def parse_json(raw: str):
+    """orjson fast path; stdlib json as a fallback for the lenient bits (NaN/Infinity)."""
+    try:
+        return orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        return json.loads(raw)
+
 def llm_json(system: str, user: str) -> dict:
     """LLM call that returns parsed JSON."""
     raw = llm_call(system, user, json_mode=True)
-    return json.loads(raw)
+    return parse_json(raw)
 
-def llm_vision(image_b64: str, prompt: str) -> str:
-    """Vision LLM call for images."""
-    response = client.chat.completions.create(
+async def llm_json_async(system: str, user: str) -> dict:
+    """Non-blocking llm_json."""
+    raw = await llm_call_async(system, user, json_mode=True)
+    return parse_json(raw)
+
+async def llm_structured(schema: type[ModelT], system: str, user: str,
+                         model: str = None, context: str = None) -> ModelT:
+    """LLM call whose output is constrained to (and parsed as) a Pydantic model."""
+    response = await aclient.beta.chat.completions.parse(
+        **_chat_kwargs(system, user, False, model, context), response_format=schema
+    )
+    parsed = response.choices[0].message.parsed
+    if parsed is None:
+        raise ValueError(f"Model refused structured output: {response.choices[0].message.refusal}")
+    return parsed
+
+def _vision_kwargs(image_b64: str, prompt: str) -> dict:
+    return dict(
         model=settings.vision_model,
         messages=[{
             "role": "user",
@@ -69,5 +132,13 @@ def llm_vision(image_b64: str, prompt: str) -> str:
         }],
         max_tokens=800,
     )
+
+def llm_vision(image_b64: str, prompt: str) -> str:
+    """Vision LLM call for images."""
+    response = client.chat.completions.create(**_vision_kwargs(image_b64, prompt))
     return response.choices[0].message.content
 
+async def llm_vision_async(image_b64: str, prompt: str) -> str:
+    """Non-blocking llm_vision."""
+    response = await aclient.chat.completions.create(**_vision_kwargs(image_b64, prompt))
+    return response.choices[0].message.content
@@ -1,16 +1,19 @@
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, BackgroundTasks
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from typing import Optional
-import uuid, shutil, json
+import uuid, json, asyncio, inspect
+from pathlib import Path
+import aiofiles
+import orjson
 
 from config import settings
 from rl_orchestrator import RLOrchestrator
 from processors import PDFProcessor, ImageProcessor, CSVProcessor
-from vectorstore import store_manager
-from bm25_store import BM25Store
-from graph_store import KnowledgeGraph
+from vectorstore import get_store_manager
+from bm25_store import get_bm25_store
+from graph_store import get_knowledge_graph, EXTRACT_CHARS
 
 app = FastAPI(title="RL-Enhanced Multi-Agent RAG System", version="2.0")
 
@@ -36,10 +39,11 @@ ext_map = {
     ".csv": "csv", ".xlsx": "csv", ".xls": "csv",
 }
 
-bm25 = BM25Store("hybrid")
-kg = KnowledgeGraph()
-orchestrator.agents["hybrid_rag"].bm25 = bm25
-orchestrator.agents["graph_rag"].kg = kg
+# The same instances the agents hold, so uploads are searchable right away.
+# Created here so the server opens Chroma at startup, not on the first request.
+store_manager = get_store_manager()
+bm25 = get_bm25_store("hybrid")
+kg = get_knowledge_graph()
 
 
 @app.get("/")
@@ -50,6 +54,7 @@ async def root():
 # ---- UPLOAD (same as before) ----
 @app.post("/upload")
 async def upload_file(
+    background: BackgroundTasks,
     file: UploadFile = File(...),
     metadata: Optional[str] = Form(None),
 ):
@@ -57,9 +62,13 @@ async def upload_file(
     ext = "." + file.filename.rsplit(".", 1)[-1].lower()
     file_type = ext_map.get(ext, "pdf")
 
-    file_path = str(settings.upload_dir / f"{file_id}_{file.filename}")
-    with open(file_path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
+    # Basename only: a client-supplied "../x" must not escape upload_dir
+    safe_name = Path(file.filename).name
+    file_path = str(settings.upload_dir / f"{file_id}_{safe_name}")
+    # Stream in 1 MiB chunks without blocking the event loop, so concurrent uploads overlap
+    async with aiofiles.open(file_path, "wb") as f:
+        while chunk := await file.read(1 << 20):
+            await f.write(chunk)
 
     try:
         meta = json.loads(metadata) if metadata else {}
@@ -69,26 +78,42 @@ async def upload_file(
     meta.update({"file_id": file_id, "source_filename": file.filename})
 
     processor = processors[file_type]
-    result = processor.process(file_path, meta)
-
-    counts = {}
-    n = store_manager.add_documents("naive_rag", result["standard_chunks"])
-    counts["naive_rag"] = n
-    n = store_manager.add_documents("sentence_window_rag", result["sentence_chunks"])
-    counts["sentence_window_rag"] = n
-    store_manager.add_documents("parent_child_rag_children", result["child_chunks"])
-    n = store_manager.add_documents("parent_child_rag_parents", result["parent_chunks"])
-    counts["parent_child_rag"] = n
-    n = store_manager.add_documents("multimodal_rag", result["standard_chunks"])
-    counts["multimodal_rag"] = n
-    if file_type == "csv":
-        n = store_manager.add_documents("table_rag", result["standard_chunks"])
-        counts["table_rag"] = n
-    bm25.add_documents(result["standard_chunks"])
+    # Async processors don't block the loop; run sync ones (PDF/CSV parsing) in a worker thread
+    if inspect.iscoroutinefunction(processor.process):
+        result = await processor.process(file_path, meta)
+    else:
+        result = await asyncio.to_thread(processor.process, file_path, meta)
+
+    # The stores are independent, so index them all at once in worker threads:
+    # upload latency is the slowest store rather than the sum of all of them
+    targets = {
+        "sentence_window_rag": ("sentence_window_rag", result["sentence_chunks"]),
+        "parent_child_rag_children": ("parent_child_rag_children", result["child_chunks"]),
+        "parent_child_rag": ("parent_child_rag_parents", result["parent_chunks"]),
+    }
+    # standard_chunks go into several collections: chunks new to any of them are embedded
+    # once (in batches) and the vectors reused; chunks already in all of them aren't embedded
+    shared = ["naive_rag", "multimodal_rag"] + (["table_rag"] if file_type == "csv" else [])
+
+    tasks = [asyncio.to_thread(store_manager.add_documents_shared, shared, result["standard_chunks"])]
+    tasks += [asyncio.to_thread(store_manager.add_documents, collection, docs)
+              for collection, docs in targets.values()]
+    tasks.append(asyncio.to_thread(bm25.add_documents, result["standard_chunks"]))
+    shared_counts, *indexed = await asyncio.gather(*tasks)
+
+    counts = dict(zip(shared, shared_counts))
+    counts.update(zip(targets, indexed))
+    del counts["parent_child_rag_children"]  # reported via parent_child_rag, as before
     counts["bm25"] = len(result["standard_chunks"])
-    if result["full_text"]:
-        kg.extract_and_add(result["full_text"][:5000], source=file.filename)
-        counts["graph_rag"] = kg.get_stats()
+    if result["full_text_preview"]:
+        # Graph extraction is LLM calls taking seconds: run them after the response is
+        # sent, one per EXTRACT_CHARS slice of the preview, concurrently on the event loop.
+        # GET /collections shows the graph once it lands.
+        preview = result["full_text_preview"]
+        slices = [(preview[i:i + EXTRACT_CHARS], file.filename)
+                  for i in range(0, len(preview), EXTRACT_CHARS)]
+        background.add_task(kg.extract_and_add_batch, slices)
+        counts["graph_rag"] = "pending"
 
     return JSONResponse(content={
         "file_id": file_id,
@@ -104,11 +129,28 @@ async def upload_file(
 async def query(
     question: str = Form(...),
     top_k: int = Form(5),
+    debug: bool = Form(False),  # include every agent's UCB scores in "routing"
 ):
-    result = await orchestrator.query(question, top_k=top_k)
+    result = await orchestrator.query(question, top_k=top_k, debug=debug)
     return JSONResponse(content=result)
 
 
+# Declared before /query/{agent_name} so "stream" isn't taken as an agent name
+@app.post("/query/stream")
+async def query_stream(
+    question: str = Form(...),
+    agent_name: Optional[str] = Form(None),
+    top_k: int = Form(5),
+    debug: bool = Form(False),
+):
+    """NDJSON: {"type": "token", "text"} lines as the answer is generated, then one
+    {"type": "done"} line with sources, routing and interaction_id."""
+    async def lines():
+        async for event in orchestrator.query_stream(question, agent_name=agent_name, top_k=top_k, debug=debug):
+            yield orjson.dumps(event) + b"\n"
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
 @app.post("/query/{agent_name}")
 async def query_agent(
     agent_name: str,
@@ -131,6 +173,22 @@ async def compare(
     return JSONResponse(content=result)
 
 
+@app.post("/compare/stream")
+async def compare_stream(
+    question: str = Form(...),
+    agents: str = Form("naive_rag,agentic_rag,hybrid_rag"),
+    top_k: int = Form(5),
+):
+    """NDJSON: one {"type": "start"} line, then a {"type": "result", "agent", "result"}
+    line per agent as soon as it finishes."""
+    agent_list = [a.strip() for a in agents.split(",")]
+
+    async def lines():
+        async for event in orchestrator.compare_stream(question, agent_list, top_k):
+            yield orjson.dumps(event) + b"\n"
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
 # ---- FEEDBACK (NEW — the reward signal) ----
 @app.post("/feedback")
 async def submit_feedback(
@@ -143,22 +201,40 @@ async def submit_feedback(
     return JSONResponse(content=result)
 
 
+# Dashboards poll these. Serialized bodies are cached per bandit version, and the
+# ETag lets an unchanged client get a bodiless 304. The per-process prefix keeps a
+# restarted server (version back at 0) from matching an old ETag.
+_ETAG_PREFIX = uuid.uuid4().hex[:8]
+_rl_cache: dict[str, tuple[int, bytes]] = {}
+
+
+def _rl_response(request: Request, key: str, build) -> Response:
+    version = orchestrator.bandit.version
+    etag = f'"{_ETAG_PREFIX}-{version}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    cached = _rl_cache.get(key)
+    if cached is None or cached[0] != version:
+        cached = _rl_cache[key] = (version, orjson.dumps(build()))
+    return Response(content=cached[1], media_type="application/json", headers={"ETag": etag})
+
+
 # ---- RL STATS (NEW — see what the bandit has learned) ----
 @app.get("/rl/stats")
-async def rl_stats():
-    return {
+async def rl_stats(request: Request):
+    return _rl_response(request, "stats", lambda: {
         "bandit_state": orchestrator.bandit.get_stats(),
         "description": "Average reward per agent per question category. Higher = better. The bandit uses these to route queries.",
-    }
+    })
 
 
 # ---- RL LEADERBOARD (NEW — ranked agent performance) ----
 @app.get("/rl/leaderboard")
-async def rl_leaderboard():
-    return {
+async def rl_leaderboard(request: Request):
+    return _rl_response(request, "leaderboard", lambda: {
         "leaderboard": orchestrator.bandit.get_leaderboard(),
         "description": "Agents ranked by overall average reward across all categories.",
-    }
+    })
 
 
 # ---- RL OPTIMIZE (NEW — run self-improvement analysis) ----
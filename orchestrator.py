@@ -5,6 +5,7 @@ MULTI-AGENT ORCHESTRATOR
 Routes queries to the best agent OR runs multiple agents in parallel.
 """
 from llm import llm_json
+from question_classifier import classify_question
 from agents.naive_rag import NaiveRAGAgent
 from agents.sentence_window_rag import SentenceWindowRAGAgent
 from agents.parent_child_rag import ParentChildRAGAgent
@@ -15,7 +16,7 @@ from agents.graph_rag import GraphRAGAgent
 from agents.hybrid_rag import HybridRAGAgent
 from agents.hyde_rag import HyDERAGAgent
 from agents.corrective_rag import CorrectiveRAGAgent
-import asyncio
+import asyncio, os
 
 class Orchestrator:
     def __init__(self):
@@ -31,12 +32,25 @@ class Orchestrator:
             "hyde_rag": HyDERAGAgent(),
             "corrective_rag": CorrectiveRAGAgent(),
         }
+        # question_classifier category -> agent, for free routing without an LLM call
+        self._cat_to_agent = {
+            "analytical": "table_rag",
+            "visual": "multimodal_rag",
+            "relational": "graph_rag",
+            "procedural": "agentic_rag",
+            "factual": "naive_rag",
+            "vague": "hyde_rag",
+        }
 
     def list_agents(self) -> list[dict]:
         return [{"name": a.name, "description": a.description} for a in self.agents.values()]
 
     async def route(self, query: str) -> str:
-        """LLM-based routing to the best agent."""
+        """Pattern-based routing: classify the question, pick that category's agent."""
+        return self._cat_to_agent.get(classify_question(query), "naive_rag")
+
+    async def route_with_llm(self, query: str) -> str:
+        """LLM-based routing to the best agent. Costs an LLM call; opt in for ambiguous queries."""
         agent_descriptions = "\n".join(
             [f"- {a.name}: {a.description}" for a in self.agents.values()]
         )
@@ -60,9 +74,10 @@ Return: {{"agent": "<name>", "reason": "..."}}""",
         )
         return result.get("agent", "naive_rag")
 
-    async def query(self, question: str, agent_name: str = None, top_k: int = 5) -> dict:
+    async def query(self, question: str, agent_name: str = None, top_k: int = 5,
+                    llm_routing: bool = False) -> dict:
         if agent_name is None:
-            agent_name = await self.route(question)
+            agent_name = await (self.route_with_llm(question) if llm_routing else self.route(question))
 
         agent = self.agents.get(agent_name)
         if not agent:
@@ -74,15 +89,29 @@ Return: {{"agent": "<name>", "reason": "..."}}""",
 
     async def compare(self, question: str, agent_names: list[str], top_k: int = 5) -> dict:
         """Run the same query on multiple agents in parallel."""
-        tasks = [self.agents[name].run(question, top_k) for name in agent_names if name in self.agents]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        names = [n for n in agent_names if n in self.agents]
+        # Same cap as the default thread pool that to_thread uses: agents are mostly
+        # waiting on the network, so a bare core count would serialize them
+        sem = asyncio.Semaphore(min(32, (os.cpu_count() or 1) + 4))
+
+        async def _run(name: str) -> dict:
+            agent = self.agents[name]
+            async with sem:
+                if agent.blocking:
+                    return await asyncio.to_thread(agent.run_sync, question, top_k)
+                return await agent.run(question, top_k)
+
+        results = await asyncio.gather(*[_run(n) for n in names], return_exceptions=True)
 
         comparison = {}
-        for name, result in zip(agent_names, results):
+        for name, result in zip(names, results):
             if isinstance(result, Exception):
                 comparison[name] = {"error": str(result)}
             else:
                 comparison[name] = result
+        for name in agent_names:
+            if name not in self.agents:
+                comparison[name] = {"error": f"Unknown agent: {name}"}
 
         return {"question": question, "comparisons": comparison}
 
@@ -4,14 +4,21 @@
 """
 File processors — each file type gets parsed, chunked, and prepared for indexing.
 """
-import base64, pandas as pd
+import base64, hashlib, asyncio, pandas as pd
+import aiofiles
 from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
 from config import settings
-from llm import llm_vision
+from llm import llm_vision_async
 import re
 
+# Length of the text prefix each processor returns for knowledge-graph extraction
+FULL_TEXT_PREVIEW_CHARS = 5000
+
+# Sentence boundary: whitespace after terminal punctuation. Compiled once for all processors.
+_SENT_RE = re.compile(r'(?<=[.!?])\s+')
+
 # ----------- TEXT / PDF -----------
 class PDFProcessor:
     def __init__(self):
@@ -32,22 +39,21 @@ class PDFProcessor:
 
         # --- Sentence-level chunks (for Sentence Window RAG) ---
         sentence_chunks = []
+        w = settings.sentence_window_size
         for page in pages:
-            sentences = re.split(r'(?<=[.!?])\s+', page.page_content)
+            sentences = _SENT_RE.split(page.page_content)
+            # Shared by every sentence on the page; each Document gets a shallow copy
+            base_meta = {**metadata, "page": page.metadata.get("page", 0)}
             for i, sent in enumerate(sentences):
-                if sent.strip():
-                    # Store surrounding sentences as metadata
-                    window_start = max(0, i - settings.sentence_window_size)
-                    window_end = min(len(sentences), i + settings.sentence_window_size + 1)
-                    window_text = " ".join(sentences[window_start:window_end])
-
+                sent = sent.strip()
+                if sent:
+                    # Store surrounding sentences as metadata (slicing clamps the end)
                     sentence_chunks.append(Document(
-                        page_content=sent.strip(),
+                        page_content=sent,
                         metadata={
-                            **metadata,
-                            "window_text": window_text,
+                            **base_meta,
+                            "window_text": " ".join(sentences[max(0, i - w):i + w + 1]),
                             "sentence_index": i,
-                            "page": page.metadata.get("page", 0),
                         }
                     ))
 
@@ -56,35 +62,49 @@ class PDFProcessor:
         parent_splitter = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=100)
         child_splitter = RecursiveCharacterTextSplitter(chunk_size=256, chunk_overlap=30)
         parent_chunks = parent_splitter.split_documents(pages)
-        child_chunks = []
+        parent_content = {}
         for i, parent in enumerate(parent_chunks):
             parent.metadata["parent_id"] = f"parent_{metadata.get('file_id', '')}_{i}"
-            children = child_splitter.split_documents([parent])
-            for child in children:
-                child.metadata["parent_id"] = parent.metadata["parent_id"]
-                child.metadata["parent_content"] = parent.page_content
-            child_chunks.extend(children)
-
-        # --- Full text for Graph RAG entity extraction ---
-        full_text = "\n".join([p.page_content for p in pages])
+            parent_content[parent.metadata["parent_id"]] = parent.page_content
+        # One splitter call for all parents; children inherit parent_id from parent metadata
+        child_chunks = child_splitter.split_documents(parent_chunks)
+        for child in child_chunks:
+            child.metadata["parent_content"] = parent_content[child.metadata["parent_id"]]
+
+        # --- Text preview for Graph RAG entity extraction ---
+        # Only the first FULL_TEXT_PREVIEW_CHARS are used, so stop collecting pages there
+        parts, total = [], 0
+        for p in pages:
+            if parts:
+                parts.append("\n")
+                total += 1
+            parts.append(p.page_content)
+            total += len(p.page_content)
+            if total >= FULL_TEXT_PREVIEW_CHARS:
+                break
+        full_text_preview = "".join(parts)[:FULL_TEXT_PREVIEW_CHARS]
 
         return {
             "standard_chunks": standard_chunks,
             "sentence_chunks": sentence_chunks,
             "parent_chunks": parent_chunks,
             "child_chunks": child_chunks,
-            "full_text": full_text,
+            "full_text_preview": full_text_preview,
             "file_type": "pdf",
         }
 
 
 # ----------- IMAGE -----------
 class ImageProcessor:
-    def process(self, file_path: str, metadata: dict) -> dict:
-        with open(file_path, "rb") as f:
-            img_b64 = base64.b64encode(f.read()).decode()
-
-        description = llm_vision(
+    async def process(self, file_path: str, metadata: dict) -> dict:
+        # Async: the read, the encode (in a thread) and the vision call all keep the event loop free
+        async with aiofiles.open(file_path, "rb") as f:
+            data = await f.read()
+        # Encode and hash in one worker-thread hop; both run over the whole image
+        img_b64, digest = await asyncio.to_thread(
+            lambda: (base64.b64encode(data).decode(), hashlib.sha256(data).hexdigest()))
+
+        description = await llm_vision_async(
             img_b64,
             "Describe this image in comprehensive detail for search indexing. "
             "Include: objects, text/labels, colors, layout, data shown, relationships between elements."
@@ -93,14 +113,14 @@ class ImageProcessor:
         doc = Document(
             page_content=description,
             metadata={**metadata, "image_path": file_path, "modality": "image",
-                      "image_b64_preview": img_b64[:500]},  # store preview for retrieval
+                      "image_sha256": digest},  # identifies the image; bytes stay on disk
         )
         return {
             "standard_chunks": [doc],
             "sentence_chunks": [doc],
             "child_chunks": [doc],
             "parent_chunks": [doc],
-            "full_text": description,
+            "full_text_preview": description[:FULL_TEXT_PREVIEW_CHARS],
             "file_type": "image",
         }
 
@@ -108,7 +128,8 @@ class ImageProcessor:
 # ----------- CSV / EXCEL -----------
 class CSVProcessor:
     def process(self, file_path: str, metadata: dict) -> dict:
-        df = pd.read_csv(file_path) if file_path.endswith(".csv") else pd.read_excel(file_path)
+        # pyarrow parses multithreaded in C++; same engine table_rag reads the file with
+        df = pd.read_csv(file_path, engine="pyarrow") if file_path.endswith(".csv") else pd.read_excel(file_path)
 
         # Schema chunk — always retrieved for table queries
         schema = f"TABLE: {metadata.get('source_filename', 'data')}\n"
@@ -124,13 +145,20 @@ class CSVProcessor:
         )
 
         # Row group chunks
+        # Format the whole frame once and slice its lines, instead of one
+        # to_string() per group. Everything above the data rows is the header.
         row_chunks = []
+        lines = df.to_string().splitlines()
+        n_header = len(lines) - len(df)
+        header, rows = lines[:n_header], lines[n_header:]
+        source = metadata.get('source_filename', 'data')
+        base_meta = {**metadata, "chunk_type": "rows"}
         for i in range(0, len(df), 25):
-            group = df.iloc[i:i+25]
-            text = f"Rows {i}-{i+len(group)} of {metadata.get('source_filename', 'data')}:\n{group.to_string()}"
+            group = rows[i:i+25]
+            text = f"Rows {i}-{i+len(group)} of {source}:\n" + "\n".join(header + group)
             row_chunks.append(Document(
                 page_content=text,
-                metadata={**metadata, "chunk_type": "rows", "row_start": i},
+                metadata={**base_meta, "row_start": i},
             ))
 
         # Store raw CSV path for text-to-pandas agent
@@ -142,7 +170,7 @@ class CSVProcessor:
             "sentence_chunks": all_chunks,
             "child_chunks": all_chunks,
             "parent_chunks": [schema_doc],
-            "full_text": schema,
+            "full_text_preview": schema[:FULL_TEXT_PREVIEW_CHARS],
             "file_type": "csv",
             "csv_path": file_path,
         }
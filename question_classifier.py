@@ -35,17 +35,77 @@ CATEGORY_PATTERNS = {
     ],
 }
 
+# Compiled once at import; /query classifies every question
+CATEGORY_PATTERNS_COMPILED = {
+    category: [re.compile(p) for p in patterns]
+    for category, patterns in CATEGORY_PATTERNS.items()
+}
+
+# Every pattern above is a \b-anchored alternation of literal phrases. Those go into
+# one Aho-Corasick automaton, so a single pass over the question finds all keywords
+# of all categories. Optional: without pyahocorasick, the compiled regexes are used.
+_LITERAL_RE = re.compile(r"\\b\(([\w |]+)\)\\b")
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+_AUTOMATON = None
+_REGEX_ONLY: dict[str, list[tuple[int, re.Pattern]]] = {}  # patterns that aren't plain literals
+if ahocorasick is not None:
+    _AUTOMATON = ahocorasick.Automaton()
+    keywords: dict[str, list[tuple[str, int]]] = {}  # phrase -> [(category, pattern index)]
+    for category, patterns in CATEGORY_PATTERNS.items():
+        for idx, p in enumerate(patterns):
+            m = _LITERAL_RE.fullmatch(p)
+            if m is None:
+                _REGEX_ONLY.setdefault(category, []).append((idx, re.compile(p)))
+                continue
+            for phrase in m.group(1).split("|"):
+                keywords.setdefault(phrase, []).append((category, idx))
+    for phrase, hits in keywords.items():
+        _AUTOMATON.add_word(phrase, (len(phrase), hits))
+    _AUTOMATON.make_automaton()
+
+
+def _is_word_char(c: str) -> bool:
+    return c.isalnum() or c == "_"
+
+
+def _matched_patterns(q: str) -> set[tuple[str, int]]:
+    """(category, pattern index) for every pattern that matches q, in one automaton pass."""
+    matched = set()
+    for end, (length, hits) in _AUTOMATON.iter(q):
+        start = end - length + 1
+        # \b on both sides: the phrase must not continue a word
+        if start > 0 and _is_word_char(q[start - 1]):
+            continue
+        if end + 1 < len(q) and _is_word_char(q[end + 1]):
+            continue
+        matched.update(hits)
+    for category, patterns in _REGEX_ONLY.items():
+        matched.update((category, idx) for idx, p in patterns if p.search(q))
+    return matched
+
 
 def classify_question(question: str) -> str:
     """Classify question into a category using pattern matching. Fast, free, no LLM."""
     q = question.lower().strip()
 
-    # Check each category
+    # Check each category: score = number of its patterns that match
     scores = {}
-    for category, patterns in CATEGORY_PATTERNS.items():
-        score = sum(1 for p in patterns if re.search(p, q))
-        if score > 0:
-            scores[category] = score
+    if _AUTOMATON is not None:
+        matched = _matched_patterns(q)
+        # Insert in CATEGORY_PATTERNS order, like the regex path: max() breaks ties by it
+        for category, patterns in CATEGORY_PATTERNS.items():
+            score = sum(1 for idx in range(len(patterns)) if (category, idx) in matched)
+            if score > 0:
+                scores[category] = score
+    else:
+        for category, patterns in CATEGORY_PATTERNS_COMPILED.items():
+            score = sum(1 for p in patterns if p.search(q))
+            if score > 0:
+                scores[category] = score
 
     if not scores:
         # Short or vague queries
@@ -1,33 +1,195 @@
-
 """
 Stores all interactions and feedback for learning.
 Uses a simple JSON-lines file — no database needed.
+Writes go through a queue to one background thread, so a burst of queries
+doesn't serialize on opening and writing the file.
+The rated records are also kept as columns in reward_log.parquet for analysis
+(see load_rated_table).
 """
-import json, os, time
+import orjson, atexit, os, queue, time
+import pyarrow as pa
+import pyarrow.parquet as pq
+from operator import itemgetter
 from pathlib import Path
 from config import settings
-from threading import Lock
+from threading import Event, Lock, Thread
 
 REWARD_LOG_PATH = settings.base_dir / "reward_log.jsonl"
+# Columnar copy of the rated records, derived from the log; safe to delete
+REWARD_PARQUET_PATH = settings.base_dir / "reward_log.parquet"
+RATED_SCHEMA = pa.schema([
+    ("reward", pa.float64()),
+    ("agent", pa.string()),
+    ("category", pa.string()),
+    ("top_k", pa.int32()),  # null when not logged
+    ("qlen", pa.int32()),   # question length in words
+])
 lock = Lock()
 
+# Writer thread flushes after this many records, or when the queue goes idle this long
+FLUSH_EVERY = 256
+FLUSH_INTERVAL = 0.05  # seconds
+
+_queue: queue.SimpleQueue = queue.SimpleQueue()  # encoded lines, or an Event to signal on flush
+_writer: Thread | None = None
+
+# interaction_id -> first record logged with that id (the query; feedback reuses the id).
+# Built from the log on first lookup and kept current by log_interaction. Other
+# processes (gunicorn workers) append to the same log, so a miss re-reads the log
+# from _index_offset, the byte up to which it has been indexed.
+_INDEX: dict[str, dict] = {}
+_index_loaded = False
+_index_offset = 0
+
+
+def _write_loop():
+    with open(REWARD_LOG_PATH, "ab", buffering=1 << 20) as f:
+        while True:
+            item = _queue.get()
+            pending = 0
+            try:
+                while True:
+                    if isinstance(item, Event):
+                        f.flush()
+                        pending = 0
+                        item.set()
+                    else:
+                        f.write(item)
+                        pending += 1
+                        if pending >= FLUSH_EVERY:
+                            f.flush()
+                            pending = 0
+                    item = _queue.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                f.flush()
+
+
+def _ensure_writer():
+    """Start the writer thread on first use. Call with lock held."""
+    global _writer
+    if _writer is None:
+        _writer = Thread(target=_write_loop, name="reward-log-writer", daemon=True)
+        _writer.start()
+
+
+def flush():
+    """Block until every record logged so far is written to disk."""
+    if _writer is None:
+        return
+    done = Event()
+    _queue.put(done)
+    done.wait()
+
+
+atexit.register(flush)
+
+
+def _index_new_records():
+    """Add records appended to the log since the last call to _INDEX. Call with lock held."""
+    global _index_loaded, _index_offset
+    flush()  # include this process's queued records
+    _index_loaded = True
+    if not REWARD_LOG_PATH.exists():
+        return
+    with open(REWARD_LOG_PATH, "rb") as f:
+        if f.seek(0, os.SEEK_END) < _index_offset:  # log was replaced: start over
+            _INDEX.clear()
+            _index_offset = 0
+        f.seek(_index_offset)
+        tail = f.read()
+    tail = tail[:tail.rfind(b"\n") + 1]  # whole lines only; another process may be mid-write
+    _index_offset += len(tail)
+    for line in tail.splitlines():
+        if line.strip():
+            record = orjson.loads(line)
+            if "interaction_id" in record:
+                _INDEX.setdefault(record["interaction_id"], record)
+
 
 def log_interaction(data: dict):
     """Append an interaction record to the log."""
     data["timestamp"] = time.time()
+    line = orjson.dumps(data) + b"\n"
+    with lock:
+        _ensure_writer()
+        _queue.put(line)
+        if _index_loaded and "interaction_id" in data:
+            _INDEX.setdefault(data["interaction_id"], data)
+
+
+def get_interaction(interaction_id: str) -> dict | None:
+    """Look up a logged interaction by id; only a miss reads the log, and only the
+    part appended since the last read."""
     with lock:
-        with open(REWARD_LOG_PATH, "a") as f:
-            f.write(json.dumps(data) + "\n")
+        found = _INDEX.get(interaction_id) if _index_loaded else None
+        if found is None:
+            _index_new_records()
+            found = _INDEX.get(interaction_id)
+        return found
 
 
 def load_all_interactions() -> list[dict]:
     """Load all logged interactions."""
+    flush()  # include records still queued for the writer
     if not REWARD_LOG_PATH.exists():
         return []
-    with open(REWARD_LOG_PATH, "r") as f:
-        return [json.loads(line) for line in f if line.strip()]
+    with open(REWARD_LOG_PATH, "rb") as f:
+        return [orjson.loads(line) for line in f if line.strip()]
 
 
 def load_interactions_for_agent(agent_name: str) -> list[dict]:
     """Load interactions for a specific agent."""
     return [i for i in load_all_interactions() if i.get("agent") == agent_name]
+
+
+# Fields every feedback record carries, fetched in one C call; top_k is only on query records
+_FEEDBACK_FIELDS = itemgetter("reward", "agent", "category", "question")
+
+
+def _rated_row(r: dict) -> tuple:
+    try:
+        reward, agent, category, question = _FEEDBACK_FIELDS(r)
+    except KeyError:  # older or hand-written records may lack some
+        reward, agent, category, question = (
+            r["reward"], r.get("agent", "unknown"), r.get("category", "unknown"), r.get("question", ""))
+    return reward, agent, category, r.get("top_k"), len(question.split())
+
+
+def _rated_columns(records: list[dict]) -> pa.Table:
+    rows = [_rated_row(r) for r in records if "reward" in r]
+    columns = list(zip(*rows)) if rows else [()] * len(RATED_SCHEMA)
+    return pa.table(dict(zip(RATED_SCHEMA.names, columns)), schema=RATED_SCHEMA)
+
+
+def load_rated_table() -> tuple[int, pa.Table]:
+    """(number of logged records, RATED_SCHEMA table of those with a reward).
+    reward_log.parquet remembers how many log bytes it covers, so only records
+    logged since the last call are parsed; the file is rebuilt if the log shrank."""
+    flush()  # include records still queued for the writer
+    if not REWARD_LOG_PATH.exists():
+        return 0, RATED_SCHEMA.empty_table()
+    size = REWARD_LOG_PATH.stat().st_size
+    covered, total, parts = 0, 0, []
+    try:
+        cached = pq.read_table(REWARD_PARQUET_PATH)
+        meta = cached.schema.metadata or {}
+        if int(meta[b"log_bytes"]) <= size:
+            covered, total = int(meta[b"log_bytes"]), int(meta[b"log_records"])
+            parts.append(cached.replace_schema_metadata(None))
+    except (OSError, KeyError, ValueError, pa.ArrowException):
+        pass  # missing or stale cache: rebuild from the whole log
+    if covered < size:
+        with open(REWARD_LOG_PATH, "rb") as f:
+            f.seek(covered)
+            tail = f.read()
+        tail = tail[:tail.rfind(b"\n") + 1]  # whole lines only; another process may be mid-write
+        records = [orjson.loads(line) for line in tail.splitlines() if line.strip()]
+        parts.append(_rated_columns(records))
+        covered, total = covered + len(tail), total + len(records)
+        table = pa.concat_tables(parts).replace_schema_metadata(
+            {"log_bytes": str(covered), "log_records": str(total)})
+        tmp = REWARD_PARQUET_PATH.with_suffix(".parquet.tmp")
+        pq.write_table(table, tmp)
+        os.replace(tmp, REWARD_PARQUET_PATH)
+        return total, table.replace_schema_metadata(None)
+    return total, pa.concat_tables(parts) if parts else RATED_SCHEMA.empty_table()
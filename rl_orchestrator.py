@@ -1,7 +1,8 @@
-import asyncio
+import asyncio, os
+from secrets import token_hex
 from bandit_router import BanditRouter
 from question_classifier import classify_question
-from reward_store import log_interaction
+from reward_store import log_interaction, get_interaction
 from self_improver import SelfImprover
 
 from agents.naive_rag import NaiveRAGAgent
@@ -39,7 +40,8 @@ class RLOrchestrator:
     def list_agents(self) -> list[dict]:
         return [{"name": a.name, "description": a.description} for a in self.agents.values()]
 
-    async def query(self, question: str, agent_name: str = None, top_k: int = 5) -> dict:
+    def _route(self, question: str, agent_name: str = None, debug: bool = False) -> tuple[str, str, dict]:
+        """Returns (category, selected agent, routing info)."""
         # Classify question (free, no LLM call)
         category = classify_question(question)
 
@@ -49,17 +51,14 @@ class RLOrchestrator:
             bandit_info = {"mode": "manual_override", "category": category}
         else:
             # Bandit selects agent
-            selected, bandit_info = self.bandit.select_agent(category)
+            selected, bandit_info = self.bandit.select_agent(category, debug=debug)
+        return category, selected, bandit_info
 
-        agent = self.agents.get(selected)
-        if not agent:
-            return {"error": f"Unknown agent: {selected}", "available": list(self.agents.keys())}
-
-        result = await agent.run(question, top_k)
-
-        # Generate interaction ID for feedback linkage
-        import uuid
-        interaction_id = str(uuid.uuid4())[:8]
+    def _record(self, result: dict, question: str, selected: str, category: str,
+                bandit_info: dict, top_k: int) -> dict:
+        """Attach RL metadata to an agent result and log the interaction."""
+        # Generate interaction ID for feedback linkage (8 hex chars)
+        interaction_id = token_hex(4)
 
         # Enrich result with RL metadata
         result["interaction_id"] = interaction_id
@@ -80,31 +79,82 @@ class RLOrchestrator:
 
         return result
 
+    async def query(self, question: str, agent_name: str = None, top_k: int = 5,
+                    debug: bool = False) -> dict:
+        category, selected, bandit_info = self._route(question, agent_name, debug)
+        agent = self.agents.get(selected)
+        if not agent:
+            return {"error": f"Unknown agent: {selected}", "available": list(self.agents.keys())}
+
+        result = await agent.run(question, top_k)
+        return self._record(result, question, selected, category, bandit_info, top_k)
+
+    async def query_stream(self, question: str, agent_name: str = None, top_k: int = 5,
+                           debug: bool = False):
+        """Like query(), as agent.stream() events; RL metadata rides on the "done" event."""
+        category, selected, bandit_info = self._route(question, agent_name, debug)
+        agent = self.agents.get(selected)
+        if not agent:
+            yield {"type": "error", "error": f"Unknown agent: {selected}", "available": list(self.agents.keys())}
+            return
+
+        async for event in agent.stream(question, top_k):
+            if event["type"] == "done":
+                event = self._record(event, question, selected, category, bandit_info, top_k)
+            yield event
+
+    def _compare_runs(self, question: str, names: list[str], top_k: int) -> list:
+        """One coroutine per agent, each resolving to (name, result or {"error": ...})."""
+        # Same cap as the default thread pool that to_thread uses: agents are mostly
+        # waiting on the network, so a bare core count would serialize them
+        sem = asyncio.Semaphore(min(32, (os.cpu_count() or 1) + 4))
+
+        async def _tagged(name: str) -> tuple[str, dict]:
+            agent = self.agents[name]
+            try:
+                async with sem:
+                    if agent.blocking:
+                        return name, await asyncio.to_thread(agent.run_sync, question, top_k)
+                    return name, await agent.run(question, top_k)
+            except Exception as e:
+                return name, {"error": str(e)}
+
+        return [_tagged(n) for n in names]
+
     async def compare(self, question: str, agent_names: list[str], top_k: int = 5) -> dict:
         category = classify_question(question)
-        tasks = [self.agents[n].run(question, top_k) for n in agent_names if n in self.agents]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-
-        comparison = {}
-        for name, result in zip(agent_names, results):
-            if isinstance(result, Exception):
-                comparison[name] = {"error": str(result)}
-            else:
-                comparison[name] = result
+        names = [n for n in agent_names if n in self.agents]
+        comparison = dict(await asyncio.gather(*self._compare_runs(question, names, top_k)))
+        for name in agent_names:
+            if name not in self.agents:
+                comparison[name] = {"error": f"Unknown agent: {name}"}
 
         return {"question": question, "category": category, "comparisons": comparison}
 
+    async def compare_stream(self, question: str, agent_names: list[str], top_k: int = 5):
+        """compare() as events: a "start" event, then one "result" event per agent in
+        the order they finish, so the fastest agent's answer arrives first."""
+        names = [n for n in agent_names if n in self.agents]
+        yield {"type": "start", "question": question, "category": classify_question(question),
+               "agents": agent_names}
+        for name in agent_names:
+            if name not in self.agents:
+                yield {"type": "result", "agent": name, "result": {"error": f"Unknown agent: {name}"}}
+
+        tasks = [asyncio.create_task(c) for c in self._compare_runs(question, names, top_k)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                name, result = await next_done
+                yield {"type": "result", "agent": name, "result": result}
+        finally:
+            # Client went away early: stop the agents still running
+            for t in tasks:
+                t.cancel()
+
     def submit_feedback(self, interaction_id: str, reward: float) -> dict:
         """Process user feedback and update bandit."""
-        from reward_store import load_all_interactions
-
         # Find the original interaction
-        interactions = load_all_interactions()
-        original = None
-        for i in interactions:
-            if i.get("interaction_id") == interaction_id:
-                original = i
-                break
+        original = get_interaction(interaction_id)
 
         if not original:
             return {"error": f"Interaction {interaction_id} not found"}
@@ -132,8 +182,6 @@ class RLOrchestrator:
             "agent": original["agent"],
             "category": original["category"],
             "reward": reward,
-            "updated_agent_stats": self.bandit.state.get(
-                original["category"], {}
-            ).get(original["agent"], {}),
+            "updated_agent_stats": self.bandit.arm_stats(original["category"], original["agent"]),
         }
 
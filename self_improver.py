@@ -11,7 +11,11 @@ What it looks at:
 - Correlation between top_k and reward → adjust default top_k
 - Time-of-day patterns, query length patterns, etc.
 """
-from reward_store import load_all_interactions
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from reward_store import load_rated_table
+from _analyze_kernels import group_sums
 from bandit_router import BanditRouter, AGENTS, CATEGORIES
 
 class SelfImprover:
@@ -20,100 +24,93 @@ class SelfImprover:
 
     def analyze(self) -> dict:
         """Run full analysis on accumulated data."""
-        interactions = load_all_interactions()
+        total, rated = load_rated_table()
 
-        if len(interactions) < 10:
+        if total < 10:
             return {
                 "status": "insufficient_data",
-                "message": f"Need at least 10 interactions with feedback. Currently have {len(interactions)}.",
-                "interactions_logged": len(interactions),
+                "message": f"Need at least 10 interactions with feedback. Currently have {total}.",
+                "interactions_logged": total,
             }
 
+        # Rated interactions as columns (reward_store keeps them in parquet): labels become
+        # small int codes via factorize (first-seen order, as the reports always listed
+        # them), and every group statistic is one pass over those codes
+        # (_analyze_kernels.group_sums).
+        rewards = rated["reward"].to_numpy()
+        agent_idx, agents = pd.factorize(rated["agent"].to_numpy())
+        cat_idx, cats = pd.factorize(rated["category"].to_numpy())
+        # Nullable Int32: a float column would turn top_k 5 into 5.0 in the report; null -> code -1
+        k_idx, ks = pd.factorize(rated["top_k"].to_pandas(types_mapper={pa.int32(): pd.Int32Dtype()}.get))
+        qlen = rated["qlen"].to_numpy()
+        # tolist(): plain Python labels for the JSON report, not NumPy scalars
+        agents, cats, ks = agents.tolist(), cats.tolist(), ks.tolist()
+
+        def group_stats(idx, vals, n):
+            """Per-group mean and count of vals, for codes 0..n-1."""
+            sums, counts = group_sums(idx, vals, n)
+            return sums / np.maximum(counts, 1), counts
+
         report = {
-            "total_interactions": len(interactions),
-            "with_feedback": len([i for i in interactions if "reward" in i]),
+            "total_interactions": total,
+            "with_feedback": rated.num_rows,
             "insights": [],
             "recommendations": [],
             "parameter_suggestions": {},
         }
 
         # ---- Analysis 1: Agent performance by category ----
-        agent_cat_perf = {}
-        for i in interactions:
-            if "reward" not in i:
-                continue
-            key = (i.get("agent", "unknown"), i.get("category", "unknown"))
-            if key not in agent_cat_perf:
-                agent_cat_perf[key] = []
-            agent_cat_perf[key].append(i["reward"])
+        # Combined (agent, category) code, factorized again to keep first-seen pair order
+        pair_idx, pairs = pd.factorize(agent_idx * len(cats) + cat_idx)
+        pair_mean, pair_n = group_stats(pair_idx, rewards, len(pairs))
 
         # Find struggling agents
-        for (agent, cat), rewards in agent_cat_perf.items():
-            avg = sum(rewards) / len(rewards)
-            if avg < 0.4 and len(rewards) >= 3:
-                report["insights"].append({
-                    "type": "low_performance",
-                    "agent": agent,
-                    "category": cat,
-                    "avg_reward": round(avg, 3),
-                    "sample_size": len(rewards),
-                    "message": f"{agent} struggles with {cat} questions (avg reward: {avg:.2f})"
-                })
+        for p in np.flatnonzero((pair_mean < 0.4) & (pair_n >= 3)).tolist():
+            agent, cat = agents[pairs[p] // len(cats)], cats[pairs[p] % len(cats)]
+            avg, n = float(pair_mean[p]), int(pair_n[p])
+            report["insights"].append({
+                "type": "low_performance",
+                "agent": agent,
+                "category": cat,
+                "avg_reward": round(avg, 3),
+                "sample_size": n,
+                "message": f"{agent} struggles with {cat} questions (avg reward: {avg:.2f})"
+            })
 
         # Find star agents
-        for (agent, cat), rewards in agent_cat_perf.items():
-            avg = sum(rewards) / len(rewards)
-            if avg > 0.8 and len(rewards) >= 3:
-                report["insights"].append({
-                    "type": "high_performance",
-                    "agent": agent,
-                    "category": cat,
-                    "avg_reward": round(avg, 3),
-                    "sample_size": len(rewards),
-                    "message": f"{agent} excels at {cat} questions (avg reward: {avg:.2f})"
-                })
+        for p in np.flatnonzero((pair_mean > 0.8) & (pair_n >= 3)).tolist():
+            agent, cat = agents[pairs[p] // len(cats)], cats[pairs[p] % len(cats)]
+            avg, n = float(pair_mean[p]), int(pair_n[p])
+            report["insights"].append({
+                "type": "high_performance",
+                "agent": agent,
+                "category": cat,
+                "avg_reward": round(avg, 3),
+                "sample_size": n,
+                "message": f"{agent} excels at {cat} questions (avg reward: {avg:.2f})"
+            })
 
         # ---- Analysis 2: Top-K effectiveness ----
-        topk_rewards = {}
-        for i in interactions:
-            if "reward" not in i or "top_k" not in i:
-                continue
-            k = i["top_k"]
-            if k not in topk_rewards:
-                topk_rewards[k] = []
-            topk_rewards[k].append(i["reward"])
-
-        if topk_rewards:
-            best_k = max(topk_rewards, key=lambda k: sum(topk_rewards[k]) / len(topk_rewards[k]))
+        if ks:
+            has_k = k_idx >= 0
+            k_mean, k_n = group_stats(k_idx[has_k], rewards[has_k], len(ks))
+            best_k = ks[int(k_mean.argmax())]
             report["parameter_suggestions"]["recommended_top_k"] = best_k
             report["insights"].append({
                 "type": "top_k_analysis",
                 "best_k": best_k,
                 "all_k_performance": {
-                    k: {"avg_reward": round(sum(v)/len(v), 3), "count": len(v)}
-                    for k, v in topk_rewards.items()
+                    k: {"avg_reward": round(float(k_mean[j]), 3), "count": int(k_n[j])}
+                    for j, k in enumerate(ks)
                 },
             })
 
         # ---- Analysis 3: Category difficulty ----
-        cat_rewards = {}
-        for i in interactions:
-            if "reward" not in i:
-                continue
-            cat = i.get("category", "unknown")
-            if cat not in cat_rewards:
-                cat_rewards[cat] = []
-            cat_rewards[cat].append(i["reward"])
-
-        hardest = None
-        hardest_avg = 1.0
-        for cat, rewards in cat_rewards.items():
-            avg = sum(rewards) / len(rewards)
-            if avg < hardest_avg:
-                hardest_avg = avg
-                hardest = cat
-
-        if hardest:
+        cat_mean, _ = group_stats(cat_idx, rewards, len(cats))
+        # Only a category averaging below 1.0 counts as hardest
+        if cats and cat_mean.min() < 1.0:
+            h = int(cat_mean.argmin())
+            hardest, hardest_avg = cats[h], float(cat_mean[h])
             report["insights"].append({
                 "type": "hardest_category",
                 "category": hardest,
@@ -122,12 +119,12 @@ class SelfImprover:
             })
 
         # ---- Analysis 4: Query length vs reward ----
-        short_q = [i for i in interactions if "reward" in i and len(i.get("question", "").split()) <= 5]
-        long_q = [i for i in interactions if "reward" in i and len(i.get("question", "").split()) > 10]
+        short_q = rewards[qlen <= 5]
+        long_q = rewards[qlen > 10]
 
-        if short_q and long_q:
-            short_avg = sum(i["reward"] for i in short_q) / len(short_q)
-            long_avg = sum(i["reward"] for i in long_q) / len(long_q)
+        if len(short_q) and len(long_q):
+            short_avg = float(short_q.sum()) / len(short_q)
+            long_avg = float(long_q.sum()) / len(long_q)
             report["insights"].append({
                 "type": "query_length",
                 "short_queries_avg": round(short_avg, 3),
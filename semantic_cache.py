@@ -0,0 +1,114 @@
+"""
+Semantic answer cache for the generate step.
+LEARNING: "What is RAG?" and "what's RAG" over the same retrieved context deserve the
+same answer. Match on query-embedding similarity, not exact text, and key on a hash
+of the context so a changed retrieval set never serves a stale answer.
+"""
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional
+
+import numpy as np
+
+from config import settings
+from embeddings import quantize_sq8
+from vectorstore import get_store_manager
+
+
+class SemanticCache:
+    def __init__(self, max_contexts: int = 1024):
+        self.max_contexts = max_contexts
+        # {(agent, ctx_hash): [{"query": str, "vec": <_pack output> | None, "answer": str}]}
+        self._buckets: OrderedDict = OrderedDict()
+        self.lock = Lock()
+
+    @staticmethod
+    def context_hash(docs: list) -> str:
+        # Process-local key, never persisted: BLAKE2b is the fastest hashlib digest in software
+        h = hashlib.blake2b(digest_size=16)
+        for d in docs:
+            h.update(d.page_content.encode())
+            h.update(b"\0")
+        return h.hexdigest()
+
+    @staticmethod
+    def _unit(vec) -> np.ndarray:
+        vec = np.asarray(vec, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    @staticmethod
+    def _pack(vec: np.ndarray):
+        """Stored form of a cached query vector: SQ8 (int8 codes, scale, zero) or float32."""
+        if not settings.semantic_cache_sq8:
+            return vec
+        q, scale, zero = quantize_sq8(vec)
+        return q[0], float(scale[0]), float(zero[0])
+
+    @staticmethod
+    def _similarity(qvec: np.ndarray, packed) -> float:
+        if isinstance(packed, np.ndarray):
+            return float(np.dot(qvec, packed))
+        # dot(qvec, q*scale + zero) without decoding the stored vector
+        q, scale, zero = packed
+        return scale * float(np.dot(qvec, q.astype(np.float32))) + zero * float(qvec.sum())
+
+    def _candidates(self, agent: str, query: str, ctx_hash: str):
+        """(exact-match answer, None) or (None, entries to compare by embedding)."""
+        with self.lock:
+            entries = self._buckets.get((agent, ctx_hash))
+            if not entries:
+                return None, None
+            self._buckets.move_to_end((agent, ctx_hash))
+            entries = list(entries)
+        for e in entries:
+            if e["query"] == query:
+                return e["answer"], None
+        return None, entries
+
+    def _best(self, entries: list, pending: list, vecs: list, threshold: float) -> Optional[str]:
+        """vecs: embeddings of the query, then of each pending entry's query."""
+        qvec = self._unit(vecs[0])
+        for e, v in zip(pending, vecs[1:]):
+            e["vec"] = self._pack(self._unit(v))
+        best, best_sim = None, threshold
+        for e in entries:
+            sim = self._similarity(qvec, e["vec"])
+            if sim >= best_sim:
+                best, best_sim = e["answer"], sim
+        return best
+
+    def lookup(self, agent: str, query: str, ctx_hash: str,
+               threshold: float = settings.semantic_cache_threshold) -> Optional[str]:
+        """Return a cached answer for a near-identical query over the same context."""
+        answer, entries = self._candidates(agent, query, ctx_hash)
+        if not entries:
+            return answer
+        # Only embed when there is something to compare against. The query vector is
+        # usually a hit in the store manager's cache, filled by retrieval.
+        pending = [e for e in entries if e["vec"] is None]
+        vecs = get_store_manager().embed_queries([query] + [e["query"] for e in pending])
+        return self._best(entries, pending, vecs, threshold)
+
+    async def alookup(self, agent: str, query: str, ctx_hash: str,
+                      threshold: float = settings.semantic_cache_threshold) -> Optional[str]:
+        """lookup() with the async embeddings client, for agents on the main event loop."""
+        answer, entries = self._candidates(agent, query, ctx_hash)
+        if not entries:
+            return answer
+        pending = [e for e in entries if e["vec"] is None]
+        vecs = await get_store_manager().aembed_queries([query] + [e["query"] for e in pending])
+        return self._best(entries, pending, vecs, threshold)
+
+    def store(self, agent: str, query: str, ctx_hash: str, answer: str):
+        with self.lock:
+            key = (agent, ctx_hash)
+            self._buckets.setdefault(key, []).append({"query": query, "vec": None, "answer": answer})
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_contexts:
+                self._buckets.popitem(last=False)
+
+
+# Global singleton
+semantic_cache = SemanticCache()
@@ -1,10 +1,11 @@
 """
 Distillation: use OpenAI as teacher to generate target answers for SFT data.
-Reads training/data/sft_train.jsonl (instruction + input), calls API for 'output', writes teacher_sft.jsonl.
+Reads training/data/sft_train.jsonl (instruction + input), calls API for 'output' (concurrently), writes teacher_sft.jsonl.
 Run after prepare_sft_data.py. Requires OPENAI_API_KEY.
 """
-import json
+import asyncio
 import sys
+import orjson
 from pathlib import Path
 
 ROOT = Path(__file__).resolve().parent.parent
@@ -15,6 +16,49 @@ DATA_DIR = Path(__file__).resolve().parent / "data"
 IN_PATH = DATA_DIR / "sft_train.jsonl"
 OUT_PATH = DATA_DIR / "teacher_sft.jsonl"
 
+CONCURRENCY = 16  # teacher calls in flight at once
+MAX_RETRIES = 5    # per record, on rate limiting
+
+
+async def teach(client, model: str, r: dict, sem: asyncio.Semaphore) -> dict:
+    """Ask the teacher for one record's output, backing off exponentially on rate limits."""
+    from openai import RateLimitError
+
+    prompt = f"{r.get('instruction','')}\n\n{r.get('input','')}\n\nOutput:"
+    async with sem:
+        for attempt in range(MAX_RETRIES):
+            try:
+                resp = await client.chat.completions.create(
+                    model=model,
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=200,
+                )
+                break
+            except RateLimitError:
+                if attempt == MAX_RETRIES - 1:
+                    raise
+                await asyncio.sleep(2 ** attempt)
+    output = resp.choices[0].message.content.strip()
+    return {"instruction": r["instruction"], "input": r["input"], "output": output}
+
+
+async def distill(records: list[dict]) -> int:
+    from config import settings
+    from openai import AsyncOpenAI
+
+    client = AsyncOpenAI(api_key=settings.openai_api_key)
+    sem = asyncio.Semaphore(CONCURRENCY)
+    tasks = [asyncio.create_task(teach(client, settings.llm_model, r, sem)) for r in records]
+    written = 0
+    # Write each example as soon as it arrives (completion order), so a crash
+    # mid-run keeps everything finished so far
+    with open(OUT_PATH, "wb") as f:
+        for next_done in asyncio.as_completed(tasks):
+            f.write(orjson.dumps(await next_done) + b"\n")
+            f.flush()
+            written += 1
+    return written
+
 
 def main():
     if not IN_PATH.exists():
@@ -22,34 +66,19 @@ def main():
         raise SystemExit(1)
 
     from config import settings
-    from openai import OpenAI
     if not settings.openai_api_key:
         print("Set OPENAI_API_KEY in .env or environment")
         raise SystemExit(1)
 
-    client = OpenAI(api_key=settings.openai_api_key)
     records = []
-    with open(IN_PATH) as f:
+    with open(IN_PATH, "rb") as f:
         for line in f:
             if line.strip():
-                records.append(json.loads(line))
+                records.append(orjson.loads(line))
 
     DATA_DIR.mkdir(parents=True, exist_ok=True)
-    out_records = []
-    for r in records:
-        prompt = f"{r.get('instruction','')}\n\n{r.get('input','')}\n\nOutput:"
-        resp = client.chat.completions.create(
-            model=settings.llm_model,
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=200,
-        )
-        output = resp.choices[0].message.content.strip()
-        out_records.append({"instruction": r["instruction"], "input": r["input"], "output": output})
-
-    with open(OUT_PATH, "w") as f:
-        for o in out_records:
-            f.write(json.dumps(o) + "\n")
-    print(f"Wrote {len(out_records)} teacher examples to {OUT_PATH}")
+    written = asyncio.run(distill(records))
+    print(f"Wrote {written} teacher examples to {OUT_PATH}")
     return OUT_PATH
 
 
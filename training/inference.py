@@ -13,12 +13,46 @@ if str(ROOT) not in sys.path:
 
 _model = None
 _tokenizer = None
+_prefix_ids: list[int] = []
+_load_failed = False  # set once a load fails, so callers fall back without retrying per request
+
+BASE_MODEL = "distilgpt2"
+
+# Fixed head of the SFT prompt format (train_lora.format_example + prepare_sft_data),
+# tokenized once per model load. It ends before the space of " Context:" because GPT-2's
+# BPE attaches a leading space to the next word: splitting here gives the same ids as
+# tokenizing the whole prompt.
+SYSTEM_PREFIX = (
+    "Instruction: Answer based only on the context. If the context does not contain "
+    "the answer, say so.\nInput:"
+)
+
+
+def quantize_int8(model):
+    """Dynamic int8 quantization of nn.Linear layers for CPU inference; returns the
+    model unchanged if this torch build has no quantized backend."""
+    import torch
+    try:
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    except Exception:
+        return model
+
+
+def tokenizer_source(adapters_path, base: str = BASE_MODEL) -> str:
+    """The adapters dir if train_lora saved a tokenizer there (older adapter dirs
+    have none), else the base model's."""
+    path = Path(adapters_path)
+    if (path / "tokenizer.json").exists() or (path / "tokenizer_config.json").exists():
+        return str(path)
+    return base
 
 
 def get_local_model(adapters_path: Optional[Path] = None):
-    global _model, _tokenizer
+    global _model, _tokenizer, _prefix_ids, _load_failed
     if _model is not None:
         return _model, _tokenizer
+    if _load_failed:
+        return None, None
     from config import settings
     path = adapters_path or getattr(settings, "lora_adapters_path", None)
     if not path:
@@ -29,31 +63,64 @@ def get_local_model(adapters_path: Optional[Path] = None):
     try:
         from transformers import AutoModelForCausalLM, AutoTokenizer
         from peft import PeftModel
-    except ImportError:
+
+        # Fast tokenizer from the tokenizer.json train_lora saved with the adapters
+        tokenizer = AutoTokenizer.from_pretrained(tokenizer_source(path), use_fast=True)
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        model = AutoModelForCausalLM.from_pretrained(BASE_MODEL)
+        model = PeftModel.from_pretrained(model, str(path))
+        # Fold the adapters into the base weights once: plain Linear layers at inference,
+        # with no extra LoRA branch in every attention forward
+        model = model.merge_and_unload()
+        model.eval()
+        # Generation is weight-bound on CPU: int8 weights halve the bytes per matmul
+        model = quantize_int8(model)
+        prefix_ids = tokenizer(SYSTEM_PREFIX).input_ids
+    except Exception:
+        _load_failed = True
         return None, None
-    base = "distilgpt2"
-    _tokenizer = AutoTokenizer.from_pretrained(str(path))
-    if _tokenizer.pad_token is None:
-        _tokenizer.pad_token = _tokenizer.eos_token
-    _model = AutoModelForCausalLM.from_pretrained(base)
-    _model = PeftModel.from_pretrained(_model, str(path))
-    _model.eval()
+    _model, _tokenizer, _prefix_ids = model, tokenizer, prefix_ids
     return _model, _tokenizer
 
 
-def generate(prompt: str, max_new_tokens: int = 120) -> Optional[str]:
-    """Generate with local LoRA model. Returns None if not available."""
-    model, tokenizer = get_local_model()
-    if model is None or tokenizer is None:
-        return None
+def _sample(model, tokenizer, input_ids, attention_mask, max_new_tokens: int):
     import torch
-    inputs = tokenizer(prompt, return_tensors="pt")
-    with torch.no_grad():
-        out = model.generate(
-            **inputs,
+    # inference_mode: like no_grad, minus autograd's version/view tracking
+    with torch.inference_mode():
+        return model.generate(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
             max_new_tokens=max_new_tokens,
             do_sample=True,
             temperature=0.7,
+            num_beams=1,
+            use_cache=True,  # reuse the KV cache across decode steps
             pad_token_id=tokenizer.eos_token_id,
         )
+
+
+def generate(prompt: str, max_new_tokens: int = 120) -> Optional[str]:
+    """Generate with local LoRA model. Returns None if not available."""
+    model, tokenizer = get_local_model()
+    if model is None or tokenizer is None:
+        return None
+    inputs = tokenizer(prompt, return_tensors="pt")
+    out = _sample(model, tokenizer, inputs["input_ids"], inputs["attention_mask"], max_new_tokens)
     return tokenizer.decode(out[0], skip_special_tokens=True)
+
+
+def generate_with_question(question: str, context: str = "", max_new_tokens: int = 120) -> Optional[str]:
+    """Answer in the SFT prompt format the adapters were trained on; only the context
+    and question are tokenized per call. context is the raw passage text (the
+    "Context:" header is added here). Returns the answer text, or None if the
+    local model is not available."""
+    model, tokenizer = get_local_model()
+    if model is None or tokenizer is None:
+        return None
+    import torch
+    suffix = tokenizer(f" Context:\n{context}\n\nQuestion: {question}\nOutput:",
+                       add_special_tokens=False).input_ids
+    input_ids = torch.tensor([_prefix_ids + suffix])
+    out = _sample(model, tokenizer, input_ids, torch.ones_like(input_ids), max_new_tokens)
+    return tokenizer.decode(out[0, input_ids.shape[1]:], skip_special_tokens=True).strip()
@@ -2,8 +2,8 @@
 Prepare SFT (supervised fine-tuning) data from reward log or demo set.
 Outputs training/data/sft_train.jsonl for use by train_lora.py.
 """
-import json
 import sys
+import orjson
 from pathlib import Path
 
 # Project root
@@ -41,21 +41,21 @@ def load_reward_log_answers() -> list[dict]:
     if not log_path.exists():
         return []
     out = []
-    with open(log_path) as f:
-        for line in f:
-            if not line.strip():
-                continue
-            try:
-                row = json.loads(line)
-                # Use only feedback rows or rows that include an answer
-                if row.get("answer") and row.get("question"):
-                    out.append({
-                        "instruction": "Answer based only on the context. If the context does not contain the answer, say so.",
-                        "input": f"Context:\n{row.get('context', '')}\n\nQuestion: {row['question']}",
-                        "output": row["answer"],
-                    })
-            except (json.JSONDecodeError, KeyError):
-                continue
+    # Bytes straight to orjson: no per-line decode to str
+    for line in log_path.read_bytes().splitlines():
+        if not line.strip():
+            continue
+        try:
+            row = orjson.loads(line)
+            # Use only feedback rows or rows that include an answer
+            if row.get("answer") and row.get("question"):
+                out.append({
+                    "instruction": "Answer based only on the context. If the context does not contain the answer, say so.",
+                    "input": f"Context:\n{row.get('context', '')}\n\nQuestion: {row['question']}",
+                    "output": row["answer"],
+                })
+        except (orjson.JSONDecodeError, KeyError):
+            continue
     return out
 
 
@@ -64,9 +64,9 @@ def main():
     records = load_reward_log_answers()
     if not records:
         records = DEMO_SFT
-    with open(OUT_PATH, "w") as f:
+    with open(OUT_PATH, "wb") as f:
         for r in records:
-            f.write(json.dumps(r) + "\n")
+            f.write(orjson.dumps(r) + b"\n")
     print(f"Wrote {len(records)} SFT examples to {OUT_PATH}")
     return OUT_PATH
 
@@ -1,12 +1,17 @@
 """
-Load a model in 4-bit or 8-bit (when GPU/bitsandbytes available) and run one inference.
-Demonstrates quantization for deployment. Saves nothing; just runs and prints timing.
+Load a model in 4-bit (when GPU/bitsandbytes available) or int8 dynamic on CPU and time inference.
+Demonstrates quantization for deployment; prints timing. --loop N times N generations
+with the model loaded once. 4-bit weights are cached under adapters/.quantized/.
 """
 import argparse
+import hashlib
 import sys
 import time
+from functools import lru_cache
 from pathlib import Path
 
+import orjson
+
 ROOT = Path(__file__).resolve().parent.parent
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
@@ -15,40 +20,55 @@ ADAPTERS_DIR = Path(__file__).resolve().parent / "adapters"
 DEFAULT_MODEL = "distilgpt2"
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Run quantized model inference")
-    parser.add_argument("--model", type=str, default=DEFAULT_MODEL, help="Base model or path to adapters")
-    parser.add_argument("--adapters", type=str, default=None, help="Path to LoRA adapters (optional)")
-    parser.add_argument("--prompt", type=str, default="Instruction: Answer briefly.\nInput: What is RAG?\nOutput:", help="Prompt text")
-    parser.add_argument("--load-4bit", action="store_true", help="Load in 4-bit (needs bitsandbytes, GPU)")
-    args = parser.parse_args()
+QUANT_CACHE_DIR = ADAPTERS_DIR / ".quantized"  # 4-bit weights saved after the first quantization
+
+
+@lru_cache(maxsize=1)
+def bnb_config():
+    from transformers import BitsAndBytesConfig
+    return BitsAndBytesConfig(load_in_4bit=True, bnb_4bit_compute_dtype="float16")
 
+
+def _quant_cache_path(model_name: str) -> Path:
+    """Cache dir keyed by base model + quantization config, so a changed config rebuilds."""
+    key = orjson.dumps({"model": model_name, "bnb": bnb_config().to_dict()},
+                       option=orjson.OPT_SORT_KEYS, default=str)
+    return QUANT_CACHE_DIR / f"int4-{hashlib.blake2b(key, digest_size=8).hexdigest()}"
+
+
+def _load_4bit(model_name: str):
+    """4-bit model, from the safetensors cache when a previous run saved one."""
+    from transformers import AutoModelForCausalLM
+    cached = _quant_cache_path(model_name)
+    if (cached / "config.json").exists():
+        # config.json carries the quantization config; weights load already 4-bit
+        return AutoModelForCausalLM.from_pretrained(cached)
+    model = AutoModelForCausalLM.from_pretrained(model_name, quantization_config=bnb_config())
     try:
-        from transformers import AutoModelForCausalLM, AutoTokenizer
-    except ImportError:
-        print("Install: pip install -r requirements-training.txt")
-        raise SystemExit(1)
+        model.save_pretrained(cached, safe_serialization=True)
+    except Exception as e:
+        print(f"Could not cache 4-bit weights ({e}); they will be re-quantized next run.")
+    return model
 
-    load_kw = {}
-    if args.load_4bit:
-        try:
-            load_kw["load_in_4bit"] = True
-        except Exception:
-            pass
 
-    tokenizer = AutoTokenizer.from_pretrained(args.adapters or args.model)
+def load_model(args):
+    """Tokenizer and model per args: 4-bit on GPU, else int8 dynamic on CPU, plus adapters."""
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    from training.inference import tokenizer_source
+
+    tok_path = tokenizer_source(args.adapters, args.model) if args.adapters else args.model
+    tokenizer = AutoTokenizer.from_pretrained(tok_path, use_fast=True)
     if tokenizer.pad_token is None:
         tokenizer.pad_token = tokenizer.eos_token
 
+    model = None
     if args.load_4bit:
         try:
-            from transformers import BitsAndBytesConfig
-            bnb = BitsAndBytesConfig(load_in_4bit=True, bnb_4bit_compute_dtype="float16")
-            model = AutoModelForCausalLM.from_pretrained(args.model, quantization_config=bnb)
+            model = _load_4bit(args.model)
         except Exception as e:
-            print(f"4-bit load failed ({e}). Run without --load-4bit (e.g. CPU).")
-            model = AutoModelForCausalLM.from_pretrained(args.model)
-    else:
+            print(f"4-bit load failed ({e}). Falling back to int8 dynamic quantization on CPU.")
+    cpu_int8 = model is None
+    if cpu_int8:
         model = AutoModelForCausalLM.from_pretrained(args.model)
 
     if args.adapters:
@@ -60,19 +80,63 @@ def main():
         except Exception as e:
             print(f"Adapter load failed: {e}")
 
+    if cpu_int8:
+        from training.inference import quantize_int8
+        if args.adapters and hasattr(model, "merge_and_unload"):
+            model = model.merge_and_unload()  # quantize the merged weights, not the base
+        model.eval()
+        model = quantize_int8(model)
+    return model, tokenizer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run quantized model inference")
+    parser.add_argument("--model", type=str, default=DEFAULT_MODEL, help="Base model or path to adapters")
+    parser.add_argument("--adapters", type=str, default=None, help="Path to LoRA adapters (optional)")
+    parser.add_argument("--prompt", type=str, default="Instruction: Answer briefly.\nInput: What is RAG?\nOutput:", help="Prompt text")
+    parser.add_argument("--load-4bit", action="store_true", help="Load in 4-bit (needs bitsandbytes, GPU)")
+    parser.add_argument("--loop", type=int, default=1, help="Timed generations with the model loaded once")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed generations before timing (with --loop > 1)")
+    args = parser.parse_args()
+
+    try:
+        import torch
+        import transformers  # noqa: F401
+    except ImportError:
+        print("Install: pip install -r requirements-training.txt")
+        raise SystemExit(1)
+
+    start = time.perf_counter()
+    model, tokenizer = load_model(args)
+    print(f"Load: {time.perf_counter() - start:.2f}s")
+
     inputs = tokenizer(args.prompt, return_tensors="pt")
     if hasattr(model, "device"):
         inputs = {k: v.to(model.device) for k, v in inputs.items()}
     else:
         inputs = {k: v.to(next(model.parameters()).device) for k, v in inputs.items()}
 
-    start = time.perf_counter()
-    out = model.generate(**inputs, max_new_tokens=60, do_sample=True, temperature=0.7, pad_token_id=tokenizer.eos_token_id)
-    elapsed = time.perf_counter() - start
+    def run():
+        with torch.inference_mode():
+            return model.generate(**inputs, max_new_tokens=60, do_sample=True, temperature=0.7,
+                                  pad_token_id=tokenizer.eos_token_id)
+
+    # First calls pay one-off costs (allocator, kernel selection); keep them out of the timings
+    for _ in range(args.warmup if args.loop > 1 else 0):
+        run()
+    times = []
+    for _ in range(max(1, args.loop)):
+        start = time.perf_counter()
+        out = run()
+        times.append(time.perf_counter() - start)
 
     text = tokenizer.decode(out[0], skip_special_tokens=True)
     print("Generated:", text[:500])
-    print(f"Time: {elapsed:.2f}s")
+    if len(times) == 1:
+        print(f"Time: {times[0]:.2f}s")
+    else:
+        print(f"Time over {len(times)} runs: mean {sum(times) / len(times):.2f}s, "
+              f"min {min(times):.2f}s, max {max(times):.2f}s")
     return text
 
 
@@ -4,7 +4,7 @@ Uses transformers + peft. Saves adapters to training/adapters/.
 Run after prepare_sft_data.py. Works on CPU (slow) or GPU.
 """
 import argparse
-import json
+import os
 import sys
 from pathlib import Path
 
@@ -34,9 +34,15 @@ def main():
     parser.add_argument("--output", type=str, default=str(ADAPTERS_DIR), help="Where to save adapters")
     parser.add_argument("--steps", type=int, default=15, help="Training steps")
     parser.add_argument("--batch", type=int, default=1, help="Per-device batch size")
+    parser.add_argument("--num-proc", type=int, default=None, help="Processes for tokenizing (large datasets)")
     args = parser.parse_args()
 
+    # Tokenized shards are cached here and reused on reruns over the same data;
+    # must be set before datasets is imported
+    os.environ.setdefault("HF_DATASETS_CACHE", str(DATA_DIR / ".hf_cache"))
+
     try:
+        import torch
         from transformers import AutoModelForCausalLM, AutoTokenizer, TrainingArguments
         from peft import LoraConfig, get_peft_model, TaskType
         from datasets import load_dataset
@@ -49,7 +55,8 @@ def main():
         print(f"Data not found: {data_path}. Run: python training/prepare_sft_data.py")
         raise SystemExit(1)
 
-    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    # Rust tokenizer: the batched map below runs in native code, not Python BPE
+    tokenizer = AutoTokenizer.from_pretrained(args.model, use_fast=True)
     if tokenizer.pad_token is None:
         tokenizer.pad_token = tokenizer.eos_token
 
@@ -58,24 +65,32 @@ def main():
         print("No examples in data file.")
         raise SystemExit(1)
 
-    def add_text(example):
-        return {"text": format_example(example)}
-
-    dataset = dataset.map(add_text)
-
-    tokenized = dataset.map(
-        lambda x: tokenizer(
-            x["text"],
+    def tokenize(batch):
+        # Format and tokenize in one pass. No padding here: the collator pads each
+        # batch to its own longest example instead of everything to 256.
+        records = [dict(zip(batch, row)) for row in zip(*batch.values())]
+        return tokenizer(
+            [format_example(r) for r in records],
             truncation=True,
             max_length=256,
-            padding="max_length",
-        ),
+        )
+
+    tokenized = dataset.map(
+        tokenize,
         batched=True,
         remove_columns=dataset.column_names,
+        num_proc=args.num_proc,
+        load_from_cache_file=True,
     )
-    tokenized.set_format("torch")
 
+    cuda = torch.cuda.is_available()
     model = AutoModelForCausalLM.from_pretrained(args.model)
+    if cuda:
+        # Recompute activations in backward instead of storing them, so larger batches
+        # fit in GPU memory. Not on CPU, where RAM isn't the limit and it only costs time.
+        model.gradient_checkpointing_enable()
+        model.enable_input_require_grads()  # frozen embeddings: checkpointed blocks still need grads
+        model.config.use_cache = False  # KV cache is useless in training and clashes with checkpointing
     lora_config = LoraConfig(
         r=8,
         lora_alpha=16,
@@ -99,6 +114,13 @@ def main():
         save_steps=args.steps,
         logging_steps=2,
         report_to="none",
+        # bf16 halves activation/weight traffic where the GPU has bf16 tensor cores
+        bf16=cuda and torch.cuda.is_bf16_supported(),
+        gradient_checkpointing=cuda,
+        optim="adamw_torch_fused" if cuda else "adamw_torch",
+        dataloader_num_workers=min(4, os.cpu_count() or 1),
+        # Batch similar lengths together: with per-batch padding, fewer pad tokens
+        group_by_length=True,
     )
 
     from transformers import Trainer, DataCollatorForLanguageModeling
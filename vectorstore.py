@@ -9,7 +9,18 @@ from langchain.schema import Document
 from embeddings import get_embeddings
 from config import settings
 from typing import Optional
+from functools import lru_cache
+from collections import OrderedDict
+from threading import Lock
+from pybloom_live import ScalableBloomFilter
 import hashlib
+import time
+
+QUERY_VEC_CACHE_SIZE = 1024
+EMBED_BATCH = 256  # chunks per embedding call when indexing; bounds peak memory
+BLOOM_CAPACITY = 100_000  # ids per collection before the filter grows another slice
+BLOOM_ERROR_RATE = 0.001
+COUNT_TTL = 5.0  # seconds list_collections may reuse a collection's count
 
 class VectorStoreManager:
     def __init__(self):
@@ -19,6 +30,19 @@ class VectorStoreManager:
         )
         self.embeddings = get_embeddings()
         self._stores: dict[str, Chroma] = {}
+        # query text -> embedding (LRU). Repeat questions, bandit exploration and the
+        # semantic cache all embed the same query text; only the first pays the API call.
+        self._query_vecs: OrderedDict[str, list[float]] = OrderedDict()
+        self._vec_lock = Lock()
+        # collection -> Bloom filter of the chunk ids written to it. "Not in the filter"
+        # is certain, so brand-new chunks skip the Chroma lookup; "in the filter" may be a
+        # false positive and is confirmed against Chroma. Another process writing the same
+        # collection (gunicorn workers) isn't seen: its chunks are re-embedded, and the
+        # upsert leaves a single copy.
+        self._bloom: dict[str, ScalableBloomFilter] = {}
+        self._bloom_lock = Lock()
+        # collection -> (count, time.monotonic() when counted); dropped on every write here
+        self._count_cache: dict[str, tuple[int, float]] = {}
 
     def get_store(self, collection_name: str) -> Chroma:
         if collection_name not in self._stores:
@@ -27,30 +51,209 @@ class VectorStoreManager:
                 collection_name=collection_name,
                 embedding_function=self.embeddings,
             )
+            bloom = ScalableBloomFilter(initial_capacity=BLOOM_CAPACITY, error_rate=BLOOM_ERROR_RATE)
+            for doc_id in self._stores[collection_name]._collection.get(include=[])["ids"]:
+                bloom.add(doc_id)
+            with self._bloom_lock:
+                self._bloom[collection_name] = bloom
         return self._stores[collection_name]
 
+    @staticmethod
+    def _doc_ids(docs: list[Document]) -> list[str]:
+        # Content hash, so the same chunk always gets the same id (128-bit BLAKE2b)
+        return [hashlib.blake2b(d.page_content.encode(), digest_size=16).hexdigest() for d in docs]
+
+    def _novel(self, collection: str, docs: list[Document]) -> tuple[list[int], list[str]]:
+        """Positions and ids of the docs not already in the collection. Only the first
+        of several identical chunks is kept: Chroma rejects repeated ids in one write."""
+        ids = self._doc_ids(docs)
+        if not ids:
+            return [], []
+        store = self.get_store(collection)
+        bloom = self._bloom[collection]
+        # Only ids the filter may have seen need Chroma's answer. get() rejects
+        # repeated ids, so ask about each distinct id once.
+        with self._bloom_lock:
+            maybe = [doc_id for doc_id in dict.fromkeys(ids) if doc_id in bloom]
+        seen = set(store._collection.get(ids=maybe, include=[])["ids"]) if maybe else set()
+        keep = []
+        for i, doc_id in enumerate(ids):
+            if doc_id not in seen:
+                seen.add(doc_id)
+                keep.append(i)
+        # Chunks indexed before ids moved to BLAKE2b are stored under their MD5 id
+        legacy = {i: hashlib.md5(docs[i].page_content.encode()).hexdigest() for i in keep}
+        with self._bloom_lock:
+            maybe = [doc_id for doc_id in dict.fromkeys(legacy.values()) if doc_id in bloom]
+        if maybe:
+            old = set(store._collection.get(ids=maybe, include=[])["ids"])
+            keep = [i for i in keep if legacy[i] not in old]
+        return keep, [ids[i] for i in keep]
+
+    def _write(self, collection: str, ids: list[str], vecs: list[list[float]], docs: list[Document]):
+        self.get_store(collection)._collection.upsert(
+            ids=ids,
+            embeddings=vecs,
+            documents=[d.page_content for d in docs],
+            metadatas=[d.metadata or None for d in docs],  # Chroma rejects empty dicts
+        )
+        with self._bloom_lock:
+            bloom = self._bloom[collection]
+            for doc_id in ids:
+                bloom.add(doc_id)
+        self._count_cache.pop(collection, None)
+
     def add_documents(self, collection: str, docs: list[Document]):
+        """Index docs, skipping (and not re-embedding) any already in the collection.
+        New docs are embedded EMBED_BATCH at a time, one API call per batch.
+        Returns how many were added."""
+        return self.add_documents_shared([collection], docs)[0]
+
+    def add_documents_shared(self, collections: list[str], docs: list[Document]) -> list[int]:
+        """Index the same docs into several collections. Only chunks missing from at
+        least one of them are embedded (EMBED_BATCH per API call), once, and the
+        vectors are reused for every collection. Returns how many each one gained."""
+        novel = [self._novel(c, docs) for c in collections]
+        needed = sorted(set().union(*(keep for keep, _ in novel)))
+        vec_at = {}
+        for start in range(0, len(needed), EMBED_BATCH):
+            batch = needed[start:start + EMBED_BATCH]
+            vecs = self.embeddings.embed_documents([docs[i].page_content for i in batch])
+            vec_at.update(zip(batch, vecs))
+        for collection, (keep, ids) in zip(collections, novel):
+            for start in range(0, len(keep), EMBED_BATCH):
+                batch = keep[start:start + EMBED_BATCH]
+                self._write(collection, ids[start:start + EMBED_BATCH],
+                            [vec_at[i] for i in batch], [docs[i] for i in batch])
+        if needed:
+            _cached_search.cache_clear()  # new docs can change any cached ranking
+        return [len(ids) for _, ids in novel]
+
+    def _cached_vecs(self, queries: list[str]) -> list[Optional[list[float]]]:
+        with self._vec_lock:
+            vecs = [self._query_vecs.get(q) for q in queries]
+            for q, v in zip(queries, vecs):
+                if v is not None:
+                    self._query_vecs.move_to_end(q)
+            return vecs
+
+    def _remember_vecs(self, queries: list[str], vecs: list[list[float]]):
+        with self._vec_lock:
+            for q, v in zip(queries, vecs):
+                self._query_vecs[q] = v
+                self._query_vecs.move_to_end(q)
+            while len(self._query_vecs) > QUERY_VEC_CACHE_SIZE:
+                self._query_vecs.popitem(last=False)
+
+    def embed_queries(self, queries: list[str]) -> list[list[float]]:
+        """Query embeddings, cached; the misses are embedded in one API call."""
+        vecs = self._cached_vecs(queries)
+        missing = list(dict.fromkeys(q for q, v in zip(queries, vecs) if v is None))
+        if missing:
+            fresh = dict(zip(missing, self.embeddings.embed_documents(missing)))
+            self._remember_vecs(missing, list(fresh.values()))
+            vecs = [fresh[q] if v is None else v for q, v in zip(queries, vecs)]
+        return vecs
+
+    async def aembed_queries(self, queries: list[str]) -> list[list[float]]:
+        """Async embed_queries."""
+        vecs = self._cached_vecs(queries)
+        missing = list(dict.fromkeys(q for q, v in zip(queries, vecs) if v is None))
+        if missing:
+            fresh = dict(zip(missing, await self.embeddings.aembed_documents(missing)))
+            self._remember_vecs(missing, list(fresh.values()))
+            vecs = [fresh[q] if v is None else v for q, v in zip(queries, vecs)]
+        return vecs
+
+    def embed_query(self, query: str) -> list[float]:
+        return self.embed_queries([query])[0]
+
+    def _query(self, collection: str, vecs: list, k: int, filter_dict: Optional[dict] = None,
+               with_scores: bool = False) -> list[list]:
+        """One Chroma query for all vecs; per vec, docs or (doc, relevance in [0, 1]) pairs."""
         store = self.get_store(collection)
-        # Deduplicate by content hash
-        ids = [hashlib.md5(d.page_content.encode()).hexdigest() for d in docs]
-        store.add_documents(docs, ids=ids)
-        return len(docs)
+        if not vecs:
+            return []
+        res = store._collection.query(
+            query_embeddings=vecs,
+            n_results=k,
+            where=filter_dict or None,
+            include=["documents", "metadatas"] + (["distances"] if with_scores else []),
+        )
+        to_relevance = store._select_relevance_score_fn() if with_scores else None
+        out = []
+        for q in range(len(vecs)):
+            docs = [Document(page_content=text, metadata=meta or {}, id=doc_id)
+                    for text, meta, doc_id in zip(res["documents"][q], res["metadatas"][q], res["ids"][q])]
+            if with_scores:  # Chroma returns distances
+                docs = [(d, to_relevance(dist)) for d, dist in zip(docs, res["distances"][q])]
+            out.append(docs)
+        return out
+
+    def retrieve(self, collection: str, query: str, k: int = 5,
+                 filter_dict: Optional[dict] = None, with_scores: bool = False) -> list:
+        """Top-k docs for query, or (doc, relevance) pairs with with_scores. The query is
+        embedded once (and cached), whichever form the caller asks for."""
+        return self._query(collection, [self.embed_query(query)], k, filter_dict, with_scores)[0]
+
+    async def aretrieve(self, collection: str, query: str, k: int = 5,
+                        filter_dict: Optional[dict] = None, with_scores: bool = False) -> list:
+        """Like retrieve, but awaits the query embedding (the network-bound part)."""
+        vec = (await self.aembed_queries([query]))[0]
+        return self._query(collection, [vec], k, filter_dict, with_scores)[0]
 
     def search(self, collection: str, query: str, k: int = 5,
                filter_dict: Optional[dict] = None) -> list[Document]:
-        store = self.get_store(collection)
-        kwargs = {"k": k}
-        if filter_dict:
-            kwargs["filter"] = filter_dict
-        return store.similarity_search(query, **kwargs)
+        return self.retrieve(collection, query, k, filter_dict)
+
+    async def asearch(self, collection: str, query: str, k: int = 5,
+                      filter_dict: Optional[dict] = None) -> list[Document]:
+        return await self.aretrieve(collection, query, k, filter_dict)
+
+    def search_many(self, collection: str, queries: list[str], k: int = 5,
+                    filter_dict: Optional[dict] = None) -> list[list[Document]]:
+        """Search several queries: one embedding API call, one Chroma query."""
+        return self._query(collection, self.embed_queries(queries), k, filter_dict)
+
+    async def asearch_many(self, collection: str, queries: list[str], k: int = 5,
+                           filter_dict: Optional[dict] = None) -> list[list[Document]]:
+        """Async search_many."""
+        return self._query(collection, await self.aembed_queries(queries), k, filter_dict)
 
     def search_with_scores(self, collection: str, query: str, k: int = 5) -> list:
-        store = self.get_store(collection)
-        return store.similarity_search_with_relevance_scores(query, k=k)
+        """(doc, relevance) pairs, relevance in [0, 1] as similarity_search_with_relevance_scores."""
+        return self.retrieve(collection, query, k, with_scores=True)
 
     def list_collections(self) -> list[dict]:
-        collections = self.client.list_collections()
-        return [{"name": c.name, "count": c.count()} for c in collections]
+        """Names and sizes. Counts are reused for COUNT_TTL seconds, so a polling UI
+        doesn't issue a COUNT(*) per collection on every refresh."""
+        out = []
+        now = time.monotonic()
+        for c in self.client.list_collections():
+            cached = self._count_cache.get(c.name)
+            if cached is None or now - cached[1] >= COUNT_TTL:
+                cached = self._count_cache[c.name] = (c.count(), now)
+            out.append({"name": c.name, "count": cached[0]})
+        return out
+
+@lru_cache(maxsize=1)
+def get_store_manager() -> VectorStoreManager:
+    """The shared manager, created on first use: importing this module doesn't open
+    Chroma or build the embeddings client, so scripts that never search stay fast."""
+    return VectorStoreManager()
+
+
+@lru_cache(maxsize=2048)
+def _cached_search(collection: str, query: str, k: int, size: int) -> tuple[Document, ...]:
+    return tuple(get_store_manager().search(collection, query, k=k))
+
 
-# Global singleton
-store_manager = VectorStoreManager()
\ No newline at end of file
+def cached_search(collection: str, query: str, k: int = 5) -> list[Document]:
+    """get_store_manager().search memoized on (collection, query, k, collection size).
+    The size is read from Chroma on each call, so a chunk added by any process (the
+    other gunicorn worker included) misses the old entries; cache_clear() in
+    add_documents only reaches this process.
+    Returns copies so agents can annotate metadata without polluting the cache."""
+    size = get_store_manager().get_store(collection)._collection.count()
+    return [Document(page_content=d.page_content, metadata=dict(d.metadata))
+            for d in _cached_search(collection, query, k, size)]
\ No newline at end of file